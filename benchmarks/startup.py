@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Checks that the client wrappers start up within a time budget.
+
+Every wrapper is imported with python -X importtime, and a dry run is made
+against a generated configuration that doesn't use the keyring. The script
+exits with 1 if the slowest wrapper goes over budget or if a module that
+should only be loaded on demand (such as keyring) shows up.
+
+    python benchmarks/startup.py [--import-budget MS] [--run-budget MS]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENTS = ['ceilometer', 'cinder', 'glance', 'heat', 'keystone', 'neutron',
+           'nova', 'openstack', 'solum', 'swift', 'trove']
+# Modules that must not be loaded unless they are actually needed
+LAZY_MODULES = ['keyring', 'multistack.agent', 'socketserver', 'tempfile',
+                'hashlib', 'urllib.request']
+
+RUN_SCRIPT = """
+import sys
+from multistack.clients.%s import main_client
+sys.argv = ['multi%s', '--dryrun', 'all', 'list']
+main_client()
+"""
+
+
+def write_config(home, sections=50):
+    with open(os.path.join(home, '.multistack'), 'w') as config_file:
+        for i in range(sections):
+            config_file.write('[env%d]\n' % i)
+            config_file.write('OS_AUTH_URL = https://identity.example.com/\n')
+            config_file.write('OS_REGION_NAME = REGION%d\n' % i)
+            config_file.write('OS_USERNAME = user%d\n' % i)
+            config_file.write('OS_PASSWORD = password%d\n\n' % i)
+        config_file.write('[all]\nMULTISTACK_GROUP = %s\n' %
+                          ','.join('env%d' % i for i in range(sections)))
+
+
+def import_times(args, env, cwd):
+    """
+    Runs python -X importtime and returns the wall time in milliseconds and
+    the cumulative import time of each module in milliseconds.
+    """
+    start = time.time()
+    process = subprocess.Popen([sys.executable, '-X', 'importtime'] + args,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               env=env, cwd=cwd)
+    _, stderr = process.communicate()
+    wall = (time.time() - start) * 1000
+    if process.returncode != 0:
+        raise RuntimeError(stderr.decode('utf-8', 'replace'))
+    modules = {}
+    for line in stderr.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        try:
+            modules[name.strip()] = int(cumulative) / 1000.0
+        except ValueError:
+            continue
+    return wall, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--import-budget', type=float, default=100.0,
+                        metavar='MS', help='cumulative import time allowed '
+                        'for a wrapper (default: %(default)s)')
+    parser.add_argument('--run-budget', type=float, default=400.0,
+                        metavar='MS', help='wall time allowed for a dry run '
+                        'of a wrapper (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs per measurement, the best one is kept '
+                        '(default: %(default)s)')
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix='multistack-startup-')
+    try:
+        write_config(home)
+        env = dict(os.environ, HOME=home, PYTHONPATH=REPO,
+                   XDG_CONFIG_HOME=os.path.join(home, '.config'),
+                   XDG_CACHE_HOME=os.path.join(home, '.cache'))
+        # Build the compiled configuration cache before measuring
+        import_times(['-c', RUN_SCRIPT % ('nova', 'nova')], env, home)
+        failures = []
+        print('%-12s %12s %12s' % ('CLIENT', 'IMPORT (ms)', 'DRY RUN (ms)'))
+        for client in CLIENTS:
+            module = 'multistack.clients.%s' % client
+            import_ms = None
+            run_ms = None
+            for i in range(args.repeat):
+                _, modules = import_times(['-c', 'import %s' % module], env,
+                                          home)
+                if import_ms is None or modules[module] < import_ms:
+                    import_ms = modules[module]
+                wall, modules = import_times(
+                    ['-c', RUN_SCRIPT % (client, client)], env, home)
+                run_ms = wall if run_ms is None else min(run_ms, wall)
+                loaded = [name for name in LAZY_MODULES if name in modules]
+                if loaded:
+                    failures.append('%s loaded %s' % (client,
+                                                      ', '.join(loaded)))
+                    break
+            print('%-12s %12.1f %12.1f' % (client, import_ms, run_ms))
+            if import_ms > args.import_budget:
+                failures.append('%s took %.1fms to import, the budget is '
+                                '%.1fms' % (client, import_ms,
+                                            args.import_budget))
+            if run_ms > args.run_budget:
+                failures.append('%s took %.1fms for a dry run, the budget is '
+                                '%.1fms' % (client, run_ms, args.run_budget))
+    finally:
+        shutil.rmtree(home)
+
+    for failure in failures:
+        print('FAIL: %s' % failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Measures multistack's own overhead against generated configurations.
+
+Configurations with the given numbers of sections are written to a
+temporary home directory. Half of the sections keep their password in the
+keyring, either under their own name or under a shared global id, and
+every ten sections make up a group inside one group of everything. The
+keyring is replaced with one held in memory and the client is a script
+that exits straight away, so nothing outside the machine is touched.
+
+For each size the suite times loading the configuration with and without
+the compiled cache, setting client_env to the group of everything,
+resolving every environment with get_env_config, and a whole run through
+the shell. The results are printed as a table and can be written as JSON
+with --output, and compared with an earlier run with --compare.
+
+    python benchmarks/suite.py [--sizes 10,100,1000,5000] [--output FILE]
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from multistack import client  # noqa
+from multistack import config  # noqa
+from multistack import credentials  # noqa
+from multistack import shell  # noqa
+
+FORMAT_VERSION = 1
+GROUP_SIZE = 10
+SHARED_PASSWORDS = 10
+
+FAKE_CLIENT = """#!/bin/sh
+exit 0
+"""
+
+
+class MemoryKeyring(object):
+    """
+    Stands in for the keyring module, keeping passwords in a dictionary.
+    """
+
+    def __init__(self):
+        self.passwords = {}
+
+    def get_password(self, service, username):
+        return self.passwords.get((service, username))
+
+    def set_password(self, service, username, password):
+        self.passwords[(service, username)] = password
+
+    def delete_password(self, service, username):
+        del self.passwords[(service, username)]
+
+
+class BenchClient(client.MultiClient):
+
+    executable = None
+
+    def __init__(self):
+        super(BenchClient, self).__init__()
+        self.default_executable = self.executable
+
+
+def write_config(home, sections):
+    """
+    Writes a configuration with the given number of environments and fills
+    the keyring with the passwords it refers to.
+    """
+    for i in range(SHARED_PASSWORDS):
+        credentials.password_set('global', 'shared%d' % i, 'shared%d' % i)
+    groups = []
+    with open(os.path.join(home, '.multistack'), 'w') as config_file:
+        for i in range(sections):
+            config_file.write('[env%d]\n' % i)
+            config_file.write('OS_AUTH_URL = https://identity%d.example.com/'
+                              '\n' % (i % 5))
+            config_file.write('OS_REGION_NAME = REGION%d\n' % i)
+            config_file.write('OS_USERNAME = user%d\n' % i)
+            config_file.write('MULTISTACK_TAGS = region%d,all\n' % (i % 3))
+            if i % 4 == 0:
+                config_file.write('OS_PASSWORD = USE_KEYRING\n\n')
+                credentials.password_set('env%d' % i, 'OS_PASSWORD',
+                                         'password%d' % i)
+            elif i % 4 == 1:
+                config_file.write('OS_PASSWORD = USE_KEYRING[\'shared%d\']'
+                                  '\n\n' % (i % SHARED_PASSWORDS))
+            else:
+                config_file.write('OS_PASSWORD = password%d\n\n' % i)
+        for start in range(0, sections, GROUP_SIZE):
+            group = 'group%d' % (start // GROUP_SIZE)
+            members = ['env%d' % i for i in
+                       range(start, min(start + GROUP_SIZE, sections))]
+            config_file.write('[%s]\nMULTISTACK_GROUP = %s\n\n' %
+                              (group, ','.join(members)))
+            groups.append(group)
+        config_file.write('[all]\nMULTISTACK_GROUP = %s\n' % ','.join(groups))
+
+
+def measure(func, repeat, setup=None):
+    """
+    Calls func repeat times and returns how long each call took in
+    milliseconds. setup is called before each call and isn't timed.
+    """
+    runs = []
+    for i in range(repeat):
+        if setup:
+            setup()
+        start = timeit.default_timer()
+        func()
+        runs.append((timeit.default_timer() - start) * 1000)
+    return runs
+
+
+def run_shell(args):
+    """
+    Runs the client through the shell with its output thrown away.
+    """
+    argv = sys.argv
+    stdout = sys.stdout
+    stderr = sys.stderr
+    devnull = open(os.devnull, 'w')
+    sys.argv = ['multibench'] + args
+    sys.stdout = sys.stderr = devnull
+    try:
+        shell.MultiShell(BenchClient).run_client()
+    except SystemExit as e:
+        if e.code:
+            raise RuntimeError('The run exited with %s' % e.code)
+    finally:
+        sys.argv = argv
+        sys.stdout = stdout
+        sys.stderr = stderr
+        devnull.close()
+
+
+def bench_size(home, sections, args):
+    """
+    Returns the measurements for a configuration of the given size.
+    """
+    keyring = MemoryKeyring()
+    credentials._keyring = lambda: keyring
+    write_config(home, sections)
+    cache_dir = os.path.join(home, '.cache')
+
+    def clear_cache():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    results = {}
+    results['load_config_cold'] = measure(config.load_multistack_config,
+                                          args.repeat, clear_cache)
+    results['load_config_warm'] = measure(config.load_multistack_config,
+                                          args.repeat)
+
+    def set_client_env():
+        BenchClient().client_env = 'all'
+    results['client_env'] = measure(set_client_env, args.repeat)
+
+    multiclient = BenchClient()
+    envs = multiclient.get_envs('all')
+
+    def get_env_configs():
+        multiclient.credential_cache.clear()
+        for env in envs:
+            multiclient.get_env_config(env)
+    results['get_env_config'] = measure(get_env_configs, args.repeat)
+
+    if sections <= args.run_max:
+        run_args = ['--parallel', str(args.parallel), '--output', 'replay',
+                    'all', 'list']
+        results['run_client'] = measure(lambda: run_shell(run_args),
+                                        args.repeat)
+    return results
+
+
+def summarize(runs):
+    runs = sorted(runs)
+    return {'best_ms': round(runs[0], 3),
+            'median_ms': round(runs[len(runs) // 2], 3),
+            'runs_ms': [round(run, 3) for run in runs]}
+
+
+def load_previous(path):
+    """
+    Returns the best times of an earlier results file keyed by benchmark
+    name and size.
+    """
+    with open(path) as results_file:
+        previous = json.load(results_file)
+    return dict(((result['name'], result['sections']), result['best_ms'])
+                for result in previous['results'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', default='10,100,1000,5000',
+                        help='comma separated numbers of sections to '
+                        'generate (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs per measurement (default: %(default)s)')
+    parser.add_argument('--parallel', type=int, default=16,
+                        help='clients run at once by run_client '
+                        '(default: %(default)s)')
+    parser.add_argument('--run-max', type=int, default=1000, metavar='N',
+                        help='skip run_client for configurations with more '
+                        'than N sections (default: %(default)s)')
+    parser.add_argument('--output', metavar='FILE',
+                        help='write the results to FILE as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='show the change from the results in FILE')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    previous = load_previous(args.compare) if args.compare else {}
+
+    home = tempfile.mkdtemp(prefix='multistack-bench-')
+    environ = os.environ.copy()
+    cwd = os.getcwd()
+    results = []
+    try:
+        BenchClient.executable = os.path.join(home, 'fakeclient')
+        with open(BenchClient.executable, 'w') as fake_client:
+            fake_client.write(FAKE_CLIENT)
+        os.chmod(BenchClient.executable, 0o755)
+        os.environ.pop(config.AGENT_SOCKET_ENV, None)
+        os.environ.update(HOME=home,
+                          XDG_CONFIG_HOME=os.path.join(home, '.config'),
+                          XDG_CACHE_HOME=os.path.join(home, '.cache'))
+        # Somewhere without a .multistack of its own
+        os.mkdir(os.path.join(home, 'cwd'))
+        os.chdir(os.path.join(home, 'cwd'))
+
+        print('%-18s %8s %12s %12s %9s' % ('BENCHMARK', 'SECTIONS',
+                                           'BEST (ms)', 'MEDIAN (ms)',
+                                           'CHANGE'))
+        for sections in sizes:
+            measured = bench_size(home, sections, args)
+            for name in sorted(measured):
+                result = dict(name=name, sections=sections,
+                              **summarize(measured[name]))
+                results.append(result)
+                change = ''
+                before = previous.get((name, sections))
+                if before:
+                    change = '%+.1f%%' % ((result['best_ms'] - before) *
+                                          100.0 / before)
+                print('%-18s %8d %12.2f %12.2f %9s' % (
+                    name, sections, result['best_ms'], result['median_ms'],
+                    change))
+                sys.stdout.flush()
+    finally:
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(home)
+
+    if args.output:
+        with open(args.output, 'w') as results_file:
+            json.dump({'format': FORMAT_VERSION,
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'repeat': args.repeat,
+                       'parallel': args.parallel,
+                       'results': results}, results_file, indent=2,
+                      sort_keys=True)
+            results_file.write('\n')
+
+
+if __name__ == '__main__':
+    main()
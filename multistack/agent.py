@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+A small agent that keeps keyring credentials in memory between runs
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+try:
+    import SocketServer as socketserver
+except:
+    import socketserver
+
+import argparse
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+from . import config
+from . import credentials
+from . import utils
+
+SOCKET_ENV = config.AGENT_SOCKET_ENV
+DEFAULT_TTL = 3600
+CLIENT_TIMEOUT = 5
+
+
+def default_socket_path():
+    """
+    Returns a per-user location for the agent's socket.
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_dir:
+        runtime_dir = os.path.join(tempfile.gettempdir(),
+                                   'multistack-%d' % os.getuid())
+    return os.path.join(runtime_dir, 'multistack-agent.sock')
+
+
+def check_socket_dir(socket_dir):
+    """
+    Makes sure nobody else can swap the agent's socket out from under it.
+    Like ssh-agent, the directory has to belong to the user and must not be
+    writable by anyone else. A directory in the shared temporary directory
+    has to be private to the user altogether.
+    """
+    info = os.lstat(socket_dir)
+    if not stat.S_ISDIR(info.st_mode):
+        raise AttributeError('%s is not a directory' % socket_dir)
+    if info.st_uid != os.getuid():
+        raise AttributeError('%s belongs to another user, refusing to put '
+                             'the agent\'s socket there' % socket_dir)
+    shared = os.path.dirname(socket_dir) == tempfile.gettempdir()
+    mask = 0o077 if shared else 0o022
+    if info.st_mode & mask:
+        raise AttributeError('%s can be used by other users (mode %o), '
+                             'refusing to put the agent\'s socket there' %
+                             (socket_dir, stat.S_IMODE(info.st_mode)))
+
+
+class AgentCache(object):
+    """
+    Credentials retrieved from the keyring, each kept for ttl seconds.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.locked = False
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, env, parameter):
+        if self.locked:
+            return None
+        key = (env, parameter)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and (not entry[1] or entry[1] > time.time()):
+                return entry[0]
+        password = credentials.password_get(env, parameter)
+        if not password:
+            return None
+        password = password.decode('utf-8')
+        expires = time.time() + self.ttl if self.ttl else 0
+        with self.lock:
+            self.entries[key] = (password, expires)
+        return password
+
+    def flush(self):
+        with self.lock:
+            self.entries.clear()
+
+    def status(self):
+        with self.lock:
+            now = time.time()
+            live = [k for k, v in self.entries.items() if not v[1] or
+                    v[1] > now]
+        return {'locked': self.locked, 'entries': len(live), 'ttl': self.ttl}
+
+
+class AgentHandler(socketserver.StreamRequestHandler):
+    """
+    Answers one JSON request per line on the agent's socket.
+    """
+
+    def handle(self):
+        if not self.peer_allowed():
+            return
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                response = self.server.dispatch(request)
+            except Exception as e:
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+    def peer_allowed(self):
+        """
+        Only lets the agent's own user talk to it where the platform can tell
+        us who is on the other end of the socket.
+        """
+        peercred = getattr(socket, 'SO_PEERCRED', None)
+        if peercred is None:
+            return True
+        creds = self.request.getsockopt(socket.SOL_SOCKET, peercred,
+                                        struct.calcsize('3i'))
+        uid = struct.unpack('3i', creds)[1]
+        return uid == os.getuid()
+
+
+class AgentServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.path = path
+        self.cache = AgentCache(ttl)
+        socket_dir = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir, 0o700)
+        check_socket_dir(socket_dir)
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise AttributeError('%s exists and is not a socket' % path)
+            if request('status', path=path) is not None:
+                raise AttributeError('An agent is already running at %s' %
+                                     path)
+            # Left behind by an agent that didn't shut down cleanly
+            os.unlink(path)
+        # Create the socket with user-only permissions from the start
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, AgentHandler)
+        finally:
+            os.umask(umask)
+
+    def dispatch(self, request):
+        command = request.get('command')
+        if command == 'get':
+            password = self.cache.get(request['env'], request['parameter'])
+            return {'ok': password is not None, 'password': password}
+        elif command == 'flush':
+            self.cache.flush()
+        elif command == 'lock':
+            self.cache.flush()
+            self.cache.locked = True
+        elif command == 'unlock':
+            self.cache.locked = False
+        elif command == 'status':
+            return dict(ok=True, **self.cache.status())
+        elif command == 'stop':
+            threading.Thread(target=self.shutdown).start()
+        else:
+            return {'ok': False, 'error': 'Unknown command %r' % command}
+        return {'ok': True}
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def request(command, path=None, **kwargs):
+    """
+    Sends a command to the agent and returns its response, or None if there
+    is no agent to talk to.
+    """
+    path = path or os.environ.get(SOCKET_ENV)
+    if not path:
+        return None
+    kwargs['command'] = command
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CLIENT_TIMEOUT)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(kwargs).encode('utf-8') + b'\n')
+        response = sock.makefile('rb').readline()
+        return json.loads(response.decode('utf-8'))
+    except (socket.error, ValueError):
+        return None
+    finally:
+        sock.close()
+
+
+def password_get(env, parameter):
+    """
+    Retrieves a password through the agent. Returns None if no agent is
+    running or it couldn't provide the password.
+    """
+    response = request('get', env=env, parameter=parameter)
+    if not response or not response.get('ok'):
+        return None
+    return response['password'].encode('utf-8')
+
+
+def main_agent():
+    parser = argparse.ArgumentParser(
+        description='Keeps keyring credentials in memory for the multistack '
+                    'clients. Start it with eval "$(multistack-agent)".')
+    parser.add_argument('-a', '--socket', default=None,
+                        help='path of the agent\'s socket')
+    parser.add_argument('-t', '--ttl', type=int, default=DEFAULT_TTL,
+                        help='seconds to keep each credential for, 0 keeps '
+                             'them until flushed (default: %(default)s)')
+    parser.add_argument('-D', '--foreground', action='store_true',
+                        help='don\'t fork into the background')
+    group = parser.add_mutually_exclusive_group()
+    for command, help in [('flush', 'forget every cached credential'),
+                          ('lock', 'forget every cached credential and stop '
+                                   'handing out credentials'),
+                          ('unlock', 'resume handing out credentials'),
+                          ('status', 'show the state of the agent'),
+                          ('stop', 'stop the agent')]:
+        group.add_argument('--%s' % command, action='store_const',
+                           dest='command', const=command, help=help)
+    args = parser.parse_args()
+
+    path = args.socket or os.environ.get(SOCKET_ENV)
+    if args.command:
+        if not path:
+            utils.print_error('No agent socket given and %s is not set' %
+                              SOCKET_ENV)
+        response = request(args.command, path=path)
+        if response is None:
+            utils.print_error('Could not reach an agent at %s' % path)
+        if not response.get('ok'):
+            utils.print_error(response.get('error'))
+        if args.command == 'status':
+            for key in sorted(response):
+                if key != 'ok':
+                    print('%s: %s' % (key, response[key]))
+        return
+
+    path = path or default_socket_path()
+    try:
+        server = AgentServer(path, args.ttl)
+    except AttributeError as e:
+        utils.print_error(e)
+    except (IOError, OSError) as e:
+        utils.print_error('Could not listen on %s: %s' % (path, e))
+    print('%s=%s; export %s;' % (SOCKET_ENV, path, SOCKET_ENV))
+    sys.stdout.flush()
+    if not args.foreground:
+        if os.fork():
+            os._exit(0)
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in range(3):
+            os.dup2(devnull, fd)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -16,25 +16,91 @@
 #
 
 from __future__ import absolute_import
+from __future__ import print_function
 
+try:
+    import urlparse
+except:
+    import urllib.parse as urlparse
+
+import copy
+import importlib
 import os
-import re
 import subprocess
 import sys
+import threading
+import time
 from . import config
 from . import credentials
+from . import executor
+from . import metrics
+from . import output
+from . import responses
+from . import results
+from . import timings
+from . import tokens
 from . import utils
 
+# Number of keyring lookups to run at once when resolving a group
+KEYRING_WORKERS = 8
+
+# Variables passed on from our own environment with --clean-env, on top of
+# any named in MULTISTACK_ENV_KEEP
+CLEAN_ENV_VARIABLES = ['HOME', 'LANG', 'LANGUAGE', 'LOGNAME', 'PATH', 'SHELL',
+                       'TERM', 'TMPDIR', 'TZ', 'USER', 'http_proxy',
+                       'https_proxy', 'no_proxy', 'HTTP_PROXY', 'HTTPS_PROXY',
+                       'NO_PROXY', 'REQUESTS_CA_BUNDLE', 'SSL_CERT_DIR',
+                       'SSL_CERT_FILE']
+
+# Seconds to wait before the first retry, doubled for every retry after it
+DEFAULT_BACKOFF = 1.0
+
+# Keystone password plugin arguments and the options they're read from
+PYTHON_AUTH_PARAMS = [
+    ('auth_url', ['OS_AUTH_URL']),
+    ('username', ['OS_USERNAME']),
+    ('user_id', ['OS_USER_ID']),
+    ('password', ['OS_PASSWORD']),
+    ('project_name', ['OS_PROJECT_NAME', 'OS_TENANT_NAME']),
+    ('project_id', ['OS_PROJECT_ID', 'OS_TENANT_ID']),
+    ('user_domain_name', ['OS_USER_DOMAIN_NAME']),
+    ('user_domain_id', ['OS_USER_DOMAIN_ID']),
+    ('project_domain_name', ['OS_PROJECT_DOMAIN_NAME']),
+    ('project_domain_id', ['OS_PROJECT_DOMAIN_ID']),
+]
+
+# Settings of get_run_limits that a group's section can set for its members
+LIMIT_OPTIONS = ['MULTISTACK_TIMEOUT', 'MULTISTACK_RETRIES',
+                 'MULTISTACK_BACKOFF', 'MULTISTACK_RETRY_ON',
+                 'MULTISTACK_CACHE_TTL', 'MULTISTACK_CACHE_SIZE']
+
 
 class MultiClient(object):
 
     def __init__(self):
-        self.client_config = config.load_multistack_config()
+        self.timings = timings.Timings()
+        with self.timings.span('config'):
+            self.client_config = config.load_multistack_config()
         self.available_envs = sorted(self.client_config.sections())
         self._client_env = None
         self.run_config = []
+        self.results = []
+        self.credential_cache = {}
         self.default_executable = None
+        self.python_client = None
         self.prefix_list = ['os_', 'multistack_']
+        # Commands whose output may be served from the response cache
+        self.read_only_commands = []
+        # The catalog types of the client's service, and the variables it
+        # reads a token and that service's endpoint from, so a cached token
+        # can be used without the client talking to Keystone
+        self.service_types = []
+        self.token_variables = None
+        self.sessions = {}
+        self.session_lock = threading.Lock()
+        self.deadline = None
+        self.watchdogs = set()
+        self.watchdog_lock = threading.Lock()
 
     @property
     def client_env(self):
@@ -48,57 +114,140 @@ class MultiClient(object):
         """
         Sets the client's environment to the provided entry.
         """
-        new_run_config = []
-        if new_env not in self.available_envs:
+        self.run_config = self.get_run_config(self.get_envs(new_env))
+        self._client_env = new_env
+
+    def get_run_config(self, envs):
+        """
+        Returns the [env, env_overlay] pairs to run the client with. Only the
+        variables from each environment's section are kept, the full
+        environment of the client is built when it is started.
+        """
+        if len(envs) > 1:
+            self.prefetch_creds(envs)
+        return [[env, self.get_env_overlay(env)] for env in envs]
+
+    def get_envs(self, env):
+        """
+        Returns the environments to run against for an entry, which is the
+        entry itself, the members of a group or the environments matching a
+        shell-style pattern.
+        """
+        if any(char in env for char in '*?['):
+            return self.select_envs(pattern=env)
+        if not self.client_config.has_section(env):
             msg = ('Environment \'%s\' is not in the multistack configuration '
-                   'file' % new_env)
+                   'file' % env)
             raise AttributeError(msg)
-        if config.is_env_group(self.client_config, new_env):
-            group_members = config.get_group_members(self.client_config,
-                                                     new_env)
-            # Check that the members actually exist and that they aren't groups
-            # themselves.
-            for member in group_members:
-                if member not in self.available_envs:
-                    msg = ('Group member \'%s\' is not in the multistack '
-                           'configuration file' % member)
-                    raise AttributeError(msg)
-                if config.is_env_group(self.client_config, member):
-                    msg = ('Group member \'%s\' is itself a group. Nested '
-                           'groups are unsupported at this time.' % member)
-                    raise AttributeError(msg)
-                env_config = self.get_env_config(member)
-                new_run_config.append([member, env_config])
-        else:
-            env_config = self.get_env_config(new_env)
-            new_run_config.append([new_env, env_config])
-        self.run_config = new_run_config
-        self._client_env = new_env
+        if not config.is_env_group(self.client_config, env):
+            return [env]
+        return config.get_group_members(self.client_config, env)
+
+    def select_envs(self, pattern=None, regex=None, tags=None):
+        """
+        Returns the environments matching every one of a shell-style pattern,
+        a regular expression and a tag expression that are given. Matching
+        groups are expanded to their members.
+        """
+        criteria = []
+        if pattern:
+            criteria.append(self.client_config.glob(pattern))
+        if regex:
+            criteria.append(self.client_config.match(regex))
+        if tags:
+            criteria.append(self.client_config.select_tags(tags))
+        selected = set(criteria[0]) if criteria else set()
+        for matches in criteria[1:]:
+            selected &= set(matches)
+        envs = set()
+        for env in selected:
+            if config.is_env_group(self.client_config, env):
+                envs.update(config.get_group_members(self.client_config, env))
+            else:
+                envs.add(env)
+        if not envs:
+            msg = 'No environments in the multistack configuration file match'
+            raise AttributeError(msg)
+        return sorted(envs)
+
+    def select(self, pattern=None, regex=None, tags=None):
+        """
+        Sets the client to run against the environments matching a selection
+        instead of a single entry.
+        """
+        envs = self.select_envs(pattern, regex, tags)
+        self.run_config = self.get_run_config(envs)
+        self._client_env = None
+
+    def set_run_config(self, run_config, env=None):
+        """
+        Sets the client to run with a run config that was already resolved,
+        such as one kept from an earlier run. env is the entry it was
+        resolved from, if there was one, so that its section's settings
+        apply.
+        """
+        self.run_config = run_config
+        self._client_env = env
+
+    def get_client_params(self, env):
+        """
+        Returns the options of an environment that are meant for the client as
+        (PARAM, value) pairs.
+        """
+        return [(param.upper(), value) for param, value in
+                self.client_config.prefixed_items(env, self.prefix_list)]
+
+    def get_keyring_key(self, env, param, value):
+        """
+        Returns the (env, parameter) pair a value should be looked up under in
+        the keyring, or None if the value doesn't come from the keyring.
+        """
+        return credentials.keyring_key(env, param, value)
+
+    def password_get(self, env, param):
+        """
+        Retrieves a credential from the agent or the keyring, only asking
+        once for each (env, parameter) pair.
+        """
+        key = (env, param)
+        if key not in self.credential_cache:
+            # Ask a running multistack-agent before going to the keyring
+            with self.timings.span('keyring', env):
+                password = None
+                if os.environ.get(config.AGENT_SOCKET_ENV):
+                    from . import agent
+                    password = agent.password_get(env, param)
+                if not password:
+                    password = credentials.password_get(env, param)
+            self.credential_cache[key] = password
+        return self.credential_cache[key]
+
+    def prefetch_creds(self, envs):
+        """
+        Retrieves every distinct keyring credential used by the environments
+        at once so that prep_creds doesn't have to wait on them one by one.
+        """
+        keys = set()
+        for env in envs:
+            for param, value in self.get_client_params(env):
+                key = self.get_keyring_key(env, param, value)
+                if key and key not in self.credential_cache:
+                    keys.add(key)
+        executor.run_jobs(lambda key: self.password_get(*key), sorted(keys),
+                          KEYRING_WORKERS)
 
     def prep_creds(self, env):
         """
         Finds relevant config options in the multistack config and cleans them
         up for the client.
         """
-        client_re = re.compile(r"(^%s)" % "|^".join(self.prefix_list))
-
         creds = []
-        for param, value in self.client_config.items(env):
-
-            # Skip parameters we're unfamiliar with
-            if not client_re.match(param):
-                continue
-
-            param = param.upper()
+        for param, value in self.get_client_params(env):
 
             # Get values from the keyring if we find a USE_KEYRING constant
-            if value.startswith("USE_KEYRING"):
-                rex = "USE_KEYRING\[([\x27\x22])(.*)\\1\]"
-                if value == "USE_KEYRING":
-                    credential = credentials.password_get(env, param)
-                else:
-                    global_id = re.match(rex, value).group(2)
-                    credential = credentials.password_get('global', global_id)
+            keyring_key = self.get_keyring_key(env, param, value)
+            if keyring_key:
+                credential = self.password_get(*keyring_key)
             else:
                 credential = value.strip("\"'")
 
@@ -114,14 +263,38 @@ class MultiClient(object):
 
         return creds
 
+    def get_env_overlay(self, env):
+        """
+        Returns the variables an environment sets on top of the current
+        shell environment.
+        """
+        with self.timings.span('creds', env):
+            return dict(self.prep_creds(env))
+
+    def build_env(self, env_overlay, clean=False):
+        """
+        Returns the full environment to start a client with, which is the
+        current shell environment, or only its basic variables when clean,
+        with the overlay on top.
+        """
+        if clean:
+            keep = CLEAN_ENV_VARIABLES + [
+                name.strip() for name in
+                env_overlay.get('MULTISTACK_ENV_KEEP', '').split(',')]
+            env_config = dict((name, os.environ[name]) for name in keep
+                              if name in os.environ)
+            env_config.update((name, value) for name, value in
+                              os.environ.items() if name.startswith('LC_'))
+        else:
+            env_config = os.environ.copy()
+        env_config.update(env_overlay)
+        return env_config
+
     def get_env_config(self, env):
         """
         Appends new variables to the current shell environment temporarily.
         """
-        env_config = os.environ.copy()
-        for k, v in self.prep_creds(env):
-            env_config[k] = v
-        return env_config
+        return self.build_env(self.get_env_overlay(env))
 
     def get_executable(self, env_config, multistack_args):
         if multistack_args.executable:
@@ -134,6 +307,532 @@ class MultiClient(object):
             executable = self.default_executable
         return executable
 
+    def get_parallel(self, multistack_args):
+        """
+        Returns the number of environments to run the client against at once.
+        """
+        if multistack_args.parallel is not None:
+            parallel = multistack_args.parallel
+        elif self.client_config.has_option(self.client_env,
+                                           'MULTISTACK_PARALLEL'):
+            parallel = self.client_config.get(self.client_env,
+                                              'MULTISTACK_PARALLEL')
+        else:
+            parallel = 1
+        try:
+            converted = int(parallel)
+        except ValueError:
+            converted = 0
+        if converted < 1:
+            msg = ('The parallel setting must be a positive integer, got '
+                   '\'%s\'' % parallel)
+            raise AttributeError(msg)
+        return converted
+
+    def get_deadline(self, multistack_args):
+        """
+        Returns the number of seconds the whole run may take, or None.
+        """
+        if multistack_args.deadline is not None:
+            deadline = multistack_args.deadline
+        elif self.client_config.has_option(self.client_env,
+                                           'MULTISTACK_DEADLINE'):
+            deadline = self.client_config.get(self.client_env,
+                                              'MULTISTACK_DEADLINE')
+        else:
+            return None
+        return self.get_setting({}, deadline, 'MULTISTACK_DEADLINE', float)
+
+    def get_pool(self, env, env_config):
+        """
+        Returns the name of the pool an environment's runs are limited in,
+        which is MULTISTACK_POOL if it's set or else the host of its
+        OS_AUTH_URL, so environments sharing an endpoint share a pool.
+        """
+        pool = env_config.get('MULTISTACK_POOL')
+        if pool:
+            return pool
+        auth_url = env_config.get('OS_AUTH_URL')
+        if isinstance(auth_url, bytes):
+            auth_url = auth_url.decode('utf-8')
+        if auth_url:
+            return urlparse.urlparse(auth_url).netloc or auth_url
+        return env
+
+    def get_group_config(self, options):
+        """
+        Returns the options set in the section of the entry being run, such
+        as a group, for the settings of its environments to fall back on.
+        """
+        group_config = {}
+        if self.client_env:
+            for option in options:
+                if self.client_config.has_option(self.client_env, option):
+                    group_config[option] = self.client_config.get(
+                        self.client_env, option)
+        return group_config
+
+    def get_limiter(self, jobs, keys, multistack_args):
+        """
+        Returns an executor.Limiter holding each pool to the strictest
+        concurrency and rate limits set by its environments, or by the group
+        being run, or None if no limits are set.
+        """
+        group_config = self.get_group_config(['MULTISTACK_POOL_CONCURRENCY',
+                                              'MULTISTACK_POOL_RATE'])
+        concurrency = {}
+        rate = {}
+        for (_, _, env_config, _), key in zip(jobs, keys):
+            env_config = dict(group_config, **env_config)
+            limit = self.get_setting(env_config,
+                                     multistack_args.pool_concurrency,
+                                     'MULTISTACK_POOL_CONCURRENCY', int, 1)
+            if limit is not None:
+                concurrency[key] = min(limit, concurrency.get(key, limit))
+            limit = self.get_setting(env_config, multistack_args.pool_rate,
+                                     'MULTISTACK_POOL_RATE', float)
+            if limit:
+                rate[key] = min(limit, rate.get(key, limit))
+        if not concurrency and not rate:
+            return None
+        return executor.Limiter(concurrency, rate)
+
+    def use_token_cache(self, env_config, multistack_args):
+        """
+        Returns whether multistack should authenticate on the client's behalf
+        and hand it a cached token.
+        """
+        if multistack_args.token_cache:
+            return True
+        setting = env_config.get('MULTISTACK_TOKEN_CACHE', '')
+        return setting.lower() in ('1', 'yes', 'true', 'on')
+
+    def use_clean_env(self, env_config, multistack_args):
+        """
+        Returns whether the client should only be given the basic variables
+        of our environment on top of its own.
+        """
+        if multistack_args.clean_env:
+            return True
+        setting = env_config.get('MULTISTACK_CLEAN_ENV', '')
+        return setting.lower() in ('1', 'yes', 'true', 'on')
+
+    def get_token_config(self, env_config):
+        """
+        Swaps the password in an environment for a cached Keystone token.
+        Clients that can be pointed at their service directly are also given
+        its endpoint from the token's catalog.
+        """
+        token, catalog = tokens.get_token(env_config)
+        token_config = dict(env_config)
+        token_config.pop('OS_PASSWORD', None)
+        token_config['OS_AUTH_TYPE'] = 'token'
+        token_config['OS_TOKEN'] = token
+        if self.service_types and self.token_variables:
+            url = tokens.endpoint_url(env_config, catalog, self.service_types)
+            if url:
+                token_variable, url_variable = self.token_variables
+                token_config[token_variable] = token
+                token_config.setdefault(url_variable, url)
+        return token_config
+
+    def get_setting(self, env_config, value, option, convert, minimum=0):
+        """
+        Returns a run setting from the command line or, failing that, from
+        the environment's section, or None if neither sets it.
+        """
+        if value is None:
+            value = env_config.get(option)
+        if value is None or value == '':
+            return None
+        try:
+            converted = convert(value)
+        except ValueError:
+            converted = None
+        if converted is None or converted < minimum:
+            msg = ('%s must be a number of at least %s, got \'%s\'' %
+                   (option, minimum, value))
+            raise AttributeError(msg)
+        return converted
+
+    def get_run_limits(self, env_config, multistack_args):
+        """
+        Returns the timeout, retry and response cache settings for running
+        the client against an environment. Settings the environment's own
+        section doesn't have are taken from the group being run.
+        """
+        env_config = dict(self.get_group_config(LIMIT_OPTIONS), **env_config)
+        timeout = self.get_setting(env_config, multistack_args.timeout,
+                                   'MULTISTACK_TIMEOUT', float)
+        retries = self.get_setting(env_config, multistack_args.retries,
+                                   'MULTISTACK_RETRIES', int) or 0
+        backoff = self.get_setting(env_config, multistack_args.backoff,
+                                   'MULTISTACK_BACKOFF', float)
+        retry_on = multistack_args.retry_on or \
+            env_config.get('MULTISTACK_RETRY_ON')
+        if retry_on:
+            try:
+                retry_on = set(code.strip() if code.strip() == 'timeout'
+                               else int(code)
+                               for code in retry_on.split(','))
+            except ValueError:
+                msg = ('MULTISTACK_RETRY_ON must be a list of exit codes and '
+                       '\'timeout\', got \'%s\'' % retry_on)
+                raise AttributeError(msg)
+        cache_ttl = self.get_setting(env_config, multistack_args.cache_ttl,
+                                     'MULTISTACK_CACHE_TTL', float)
+        cache_size = self.get_setting(env_config, None,
+                                      'MULTISTACK_CACHE_SIZE', float, 1)
+        return {'timeout': timeout, 'retries': retries,
+                'backoff': DEFAULT_BACKOFF if backoff is None else backoff,
+                'retry_on': retry_on or None, 'cache_ttl': cache_ttl,
+                'cache_size': cache_size or responses.DEFAULT_SIZE}
+
+    def time_left(self):
+        """
+        Returns the seconds left before the run's deadline, or None if there
+        is no deadline.
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - time.time()
+
+    def should_retry(self, result, limits):
+        """
+        Returns whether a failed run of the client is worth another try.
+        """
+        if not result.failed or result.error is not None:
+            return False
+        # The client would most likely write the same output again
+        if result.invalid_output and result.returncode == 0:
+            return False
+        if limits['retry_on'] is None:
+            return True
+        if result.timed_out:
+            return 'timeout' in limits['retry_on']
+        return result.returncode in limits['retry_on']
+
+    def get_cache_key(self, env, env_config, executable, client_args,
+                      multistack_args, limits):
+        """
+        Returns the key the output of a run is cached under, or None if the
+        response cache is off or the command isn't known to be read-only.
+        """
+        if not limits['cache_ttl'] or multistack_args.no_cache:
+            return None
+        commands = env_config.get('MULTISTACK_CACHE_COMMANDS')
+        if commands is None:
+            commands = self.read_only_commands
+        else:
+            commands = commands.split(',')
+        if not responses.is_read_only(client_args, commands):
+            return None
+        return responses.cache_key(env, executable, client_args, env_config)
+
+    def run_attempt(self, result, command, env_config, mux, label, timeout,
+                    cache_key=None, cache_size=None):
+        """
+        Runs the client once, stopping it if it runs for longer than timeout
+        or past the run's deadline. With a cache key, the output is collected
+        so that it can be cached if the client succeeds.
+        """
+        time_left = self.time_left()
+        if time_left is not None:
+            if time_left <= 0:
+                raise executor.DeadlineExceeded('The deadline passed before '
+                                                'it could be run')
+            timeout = time_left if timeout is None else min(timeout,
+                                                            time_left)
+        popen_kwargs = mux.popen_kwargs()
+        if cache_key:
+            popen_kwargs.update(stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        # Give a client that may have to be stopped its own process group,
+        # so anything it starts is stopped along with it
+        group = timeout is not None and hasattr(os, 'killpg')
+        if group and sys.version_info >= (3, 2):
+            popen_kwargs['start_new_session'] = True
+        elif group:
+            # Python 2 has no start_new_session
+            popen_kwargs['preexec_fn'] = os.setsid
+        with self.timings.span('spawn', label):
+            process = subprocess.Popen(command, env=env_config,
+                                       **popen_kwargs)
+        watchdog = executor.Watchdog(process, timeout, group)
+        with self.watchdog_lock:
+            self.watchdogs.add(watchdog)
+        try:
+            with self.timings.span('wait', label):
+                if cache_key:
+                    stdout, stderr = process.communicate()
+                else:
+                    result.output_bytes = mux.capture(label, process)
+                    # Don't exit until we're sure the subprocess has exited
+                    process.wait()
+        finally:
+            watchdog.cancel()
+            with self.watchdog_lock:
+                self.watchdogs.discard(watchdog)
+        result.returncode = process.returncode
+        result.timed_out = watchdog.fired
+        if cache_key:
+            result.output_bytes = mux.feed(label, stdout, stderr)
+        result.invalid_output = label in mux.invalid
+        if cache_key and not result.failed and not result.timed_out:
+            responses.store(cache_key, 0, stdout, stderr, cache_size)
+
+    def run_env(self, env, env_config, client_args, multistack_args, mux,
+                label=None, limits=None):
+        """
+        Runs the client against a single environment and returns an EnvResult
+        describing how it went. The label names the run in the output and
+        defaults to the environment. env_config only needs the environment's
+        own variables, the rest are added when the client is started.
+        """
+        label = label or env
+        if limits is None:
+            limits = self.get_run_limits(env_config, multistack_args)
+        # set the executable
+        with self.timings.span('executable', label):
+            executable = self.get_executable(env_config, multistack_args)
+        result = results.EnvResult(env, executable, label)
+        msg = "Running %s against %s..." % (executable, label)
+        if multistack_args.dryrun:
+            utils.print_notice(msg, title='DRY RUN')
+            print(' '.join([executable] + client_args))
+            result.returncode = 0
+            return result
+        start = time.time()
+        cache_key = self.get_cache_key(env, env_config, executable,
+                                       client_args, multistack_args, limits)
+        if cache_key and not multistack_args.refresh:
+            cached = responses.lookup(cache_key, limits['cache_ttl'])
+            if cached:
+                msg = ("Using cached output of %s against %s..." %
+                       (executable, label))
+                mux.notice(label, msg, title='CACHED')
+                result.returncode = cached[0]
+                result.cached = True
+                result.output_bytes = mux.feed(label, cached[1], cached[2])
+                result.invalid_output = label in mux.invalid
+                result.duration = time.time() - start
+                mux.finish(label, title='CACHED', msg=msg)
+                return result
+        mux.notice(label, msg)
+        try:
+            env_config = self.build_env(
+                env_config, self.use_clean_env(env_config, multistack_args))
+            if self.use_token_cache(env_config, multistack_args):
+                with self.timings.span('token', label):
+                    env_config = self.get_token_config(env_config)
+            for attempt in range(limits['retries'] + 1):
+                if attempt:
+                    delay = limits['backoff'] * 2 ** (attempt - 1)
+                    time_left = self.time_left()
+                    if time_left is not None and time_left <= delay:
+                        break
+                    mux.notice(label, 'Retrying %s against %s in %.1fs '
+                               '(attempt %d of %d)...' %
+                               (executable, label, delay, attempt + 1,
+                                limits['retries'] + 1), title='RETRY')
+                    with self.timings.span('backoff', label):
+                        time.sleep(delay)
+                result.attempts = attempt + 1
+                self.run_attempt(result, [executable] + client_args,
+                                 env_config, mux, label, limits['timeout'],
+                                 cache_key, limits['cache_size'])
+                if not self.should_retry(result, limits):
+                    break
+        except (OSError, tokens.TokenError, executor.DeadlineExceeded) as e:
+            # Allow the other environments to run if the executable isn't
+            # found, we couldn't authenticate or we ran out of time
+            result.error = e
+            result.skipped = isinstance(e, executor.DeadlineExceeded)
+            mux.error(label, e)
+        finally:
+            result.duration = time.time() - start
+            mux.finish(label, msg=msg)
+        return result
+
+    def get_output_mode(self, multistack_args, parallel, jobs):
+        """
+        Returns how the output of the clients should be shown.
+        """
+        if multistack_args.output:
+            return multistack_args.output
+        # Let a lone client have the terminal to itself
+        if parallel > 1 and jobs > 1:
+            return 'stream'
+        return 'inherit'
+
+    def run_jobs(self, jobs, multistack_args, mux=None, report=True):
+        """
+        Runs a list of (label, env, env_config, client_args) jobs, prints a
+        summary when there is more than one and returns the overall exit
+        status. A multiplexer can be given to show the output with, and the
+        summary and timings are left out when report is False.
+        """
+        # Check the exit policy before anything is run
+        results.parse_exit_policy(multistack_args.exit_policy)
+        # Nothing is spawned on a dry run, so keep its output in order
+        if multistack_args.dryrun:
+            parallel = 1
+        else:
+            parallel = self.get_parallel(multistack_args)
+        labels = [label for label, _, _, _ in jobs]
+        if mux is None and multistack_args.merge_json and \
+                not multistack_args.dryrun:
+            mux = output.JsonMultiplexer(labels, multistack_args.merge_json)
+        elif mux is None:
+            mux = output.OutputMultiplexer(
+                labels,
+                self.get_output_mode(multistack_args, parallel, len(jobs)))
+
+        # Check every environment's limits before anything is run
+        limits = [self.get_run_limits(env_config, multistack_args)
+                  for _, _, env_config, _ in jobs]
+        deadline = self.get_deadline(multistack_args)
+        statsd = self.get_entry_option(multistack_args.statsd,
+                                       'MULTISTACK_STATSD')
+        if statsd:
+            metrics.parse_address(statsd)
+        self.deadline = time.time() + deadline if deadline else None
+
+        def run_job(job):
+            (label, env, env_config, client_args), job_limits = job
+            return self.run_env(env, env_config, client_args, multistack_args,
+                                mux, label, job_limits)
+
+        keys = [self.get_pool(env, env_config)
+                for _, env, env_config, _ in jobs]
+        if multistack_args.dryrun:
+            limiter = None
+        else:
+            limiter = self.get_limiter(jobs, keys, multistack_args)
+
+        try:
+            self.results = executor.run_jobs(run_job, zip(jobs, limits),
+                                             parallel, keys, limiter)
+        except KeyboardInterrupt:
+            # Clients in their own process group don't see the interrupt
+            with self.watchdog_lock:
+                for watchdog in self.watchdogs:
+                    watchdog.terminate()
+            raise
+        finally:
+            mux.close()
+        if (report and len(self.results) > 1 and
+                not multistack_args.dryrun):
+            results.print_summary(self.results, file=mux.notices)
+        if not multistack_args.dryrun:
+            self.export_metrics(multistack_args, mux)
+        if report:
+            self.report_timings(multistack_args, mux.notices)
+        return results.exit_status(self.results, multistack_args.exit_policy)
+
+    def report_timings(self, multistack_args, file):
+        """
+        Prints the timings and writes the trace, if either is asked for.
+        """
+        if multistack_args.timings:
+            self.timings.print_breakdown(file=file)
+        if multistack_args.trace:
+            try:
+                self.timings.write_trace(multistack_args.trace)
+            except (IOError, OSError) as e:
+                utils.print_error('Could not write the trace: %s' % e,
+                                  exit=False)
+
+    def run_watch(self, jobs, multistack_args):
+        """
+        Runs the jobs every --watch seconds until interrupted, printing only
+        the changes in each job's output and status since the run before.
+        The run config is kept between runs, so credentials are only
+        resolved once. Every job is run at once unless --parallel or
+        MULTISTACK_PARALLEL say otherwise. The timings only cover resolving
+        the environments and the latest run. Returns the exit status of the
+        last complete run.
+        """
+        if multistack_args.watch <= 0:
+            raise AttributeError('--watch must be a number of seconds above '
+                                 '0, got \'%s\'' % multistack_args.watch)
+        if multistack_args.dryrun or multistack_args.merge_json or \
+                multistack_args.output:
+            raise AttributeError('--watch can\'t be used with --dryrun, '
+                                 '--output, --merge-json or --ndjson')
+        if self.get_entry_option(multistack_args.parallel,
+                                 'MULTISTACK_PARALLEL') is None:
+            multistack_args = copy.copy(multistack_args)
+            multistack_args.parallel = len(jobs)
+        labels = [label for label, _, _, _ in jobs]
+        snapshots = {}
+        statuses = {}
+        returncode = 0
+        next_run = time.time()
+        setup_spans = list(self.timings.spans)
+        try:
+            while True:
+                # Drop the spans of the run before so they don't pile up
+                self.timings = timings.Timings()
+                self.timings.spans.extend(setup_spans)
+                mux = output.WatchMultiplexer(labels, snapshots)
+                returncode = self.run_jobs(jobs, multistack_args, mux,
+                                           report=False)
+                for result in self.results:
+                    previous = statuses.get(result.label)
+                    if previous is not None and previous != result.status:
+                        utils.print_notice('%s went from %s to %s' %
+                                           (result.label, previous,
+                                            result.status), title='STATUS')
+                    statuses[result.label] = result.status
+                # Keep to the schedule, but don't try to catch up on runs
+                # that took longer than the interval
+                now = time.time()
+                next_run = max(next_run + multistack_args.watch, now)
+                time.sleep(max(0, next_run - now))
+        except KeyboardInterrupt:
+            print()
+        self.report_timings(multistack_args, sys.stdout)
+        return returncode
+
+    def get_entry_option(self, value, option):
+        """
+        Returns a setting from the command line or, failing that, from the
+        section of the entry being run, or None if neither sets it.
+        """
+        if value is not None:
+            return value
+        if self.client_env and self.client_config.has_option(self.client_env,
+                                                             option):
+            return self.client_config.get(self.client_env, option)
+        return None
+
+    def export_metrics(self, multistack_args, mux):
+        """
+        Writes the results of the run to a Prometheus textfile and sends
+        them to StatsD, if either is asked for. A failure to export is
+        reported but doesn't change the outcome of the run.
+        """
+        textfile = self.get_entry_option(multistack_args.metrics_file,
+                                         'MULTISTACK_METRICS_FILE')
+        statsd = self.get_entry_option(multistack_args.statsd,
+                                       'MULTISTACK_STATSD')
+        if not textfile and not statsd:
+            return
+        executable = os.path.basename(multistack_args.executable or
+                                      self.default_executable)
+        keyring_times = dict((env, seconds) for env, seconds in
+                             self.timings.totals('keyring').items() if env)
+        try:
+            if textfile:
+                metrics.write_textfile(textfile, metrics.prometheus_lines(
+                    self.results, keyring_times, executable))
+            if statsd:
+                metrics.send_statsd(statsd, metrics.statsd_lines(
+                    self.results, keyring_times, executable))
+        except (IOError, OSError) as e:
+            utils.print_error('Could not export metrics: %s' % e, exit=False)
+
     def run_client(self, client_args, multistack_args):
         """
         Sets the environment variables for the client, runs the client, and
@@ -142,40 +841,126 @@ class MultiClient(object):
         # Check for a debug override
         if multistack_args.debug:
             client_args.insert(0, '--debug')
-        for env, env_config in self.run_config:
-            # set the executable
-            executable = self.get_executable(env_config, multistack_args)
-            if multistack_args.dryrun:
-                msg = "Running %s against %s..." % (executable, env)
-                utils.print_notice(msg, title='DRY RUN')
-                print(' '.join([executable] + client_args))
-                returncode = 0
-            else:
-                msg = "Running %s against %s..." % (executable, env)
-                utils.print_notice(msg, title='MULTISTACK')
+        jobs = [(env, env, env_config, client_args)
+                for env, env_config in self.run_config]
+        if multistack_args.watch is not None:
+            return self.run_watch(jobs, multistack_args)
+        return self.run_jobs(jobs, multistack_args)
+
+    def run_batch(self, commands, multistack_args):
+        """
+        Runs every command against every environment of the run config as
+        one set of jobs, so the configuration and credentials are only
+        resolved once. Each command is a list of client arguments.
+        """
+        jobs = []
+        for number, client_args in enumerate(commands, 1):
+            # Check for a debug override
+            if multistack_args.debug:
+                client_args = ['--debug'] + client_args
+            for env, env_config in self.run_config:
+                label = '%s #%d' % (env, number)
+                jobs.append((label, env, env_config, client_args))
+        if multistack_args.watch is not None:
+            return self.run_watch(jobs, multistack_args)
+        return self.run_jobs(jobs, multistack_args)
+
+    def make_client(self, session, creds):
+        """
+        Builds the python client object for an authenticated session. Client
+        wrappers set python_client to the (module, class, version) of their
+        client, or override this when their client is built differently.
+        """
+        if not self.python_client:
+            msg = ('Building a python client is not supported for %s' %
+                   self.default_executable)
+            raise NotImplementedError(msg)
+        module_name, class_name, version = self.python_client
+        client_class = getattr(importlib.import_module(module_name),
+                               class_name)
+        args = [version] if version else []
+        kwargs = {'session': session}
+        if creds.get('OS_REGION_NAME'):
+            kwargs['region_name'] = creds['OS_REGION_NAME']
+        return client_class(*args, **kwargs)
+
+    def get_session(self, env):
+        """
+        Returns the keystoneauth session for an environment. Each environment
+        gets one session, and so one authentication and one pool of
+        keep-alive connections, which is reused by every client built for it.
+        """
+        with self.session_lock:
+            if env not in self.sessions:
                 try:
-                    process = subprocess.Popen([executable] + client_args,
-                                               stdout=sys.stdout,
-                                               stderr=sys.stderr,
-                                               env=env_config)
-                    # Don't exit until we're sure the subprocess has exited
-                    process.wait()
-                    # Return the return code of the process
-                    returncode = process.returncode
-                except OSError as e:
-                    # Allow the loop to continue if the executable isn't found
-                    utils.print_error(e, exit=False)
-                    returncode = 1
-        return returncode
+                    from keystoneauth1 import loading
+                    from keystoneauth1 import session
+                except ImportError:
+                    raise ImportError('keystoneauth1 is needed to build '
+                                      'python clients, install it with pip '
+                                      'install multistack[python]')
+                auth_kwargs, session_kwargs = self.prep_python_creds(env)
+                loader = loading.get_plugin_loader('password')
+                auth = loader.load_from_options(**auth_kwargs)
+                self.sessions[env] = session.Session(auth=auth,
+                                                     **session_kwargs)
+            return self.sessions[env]
 
-    def get_client(self):
+    def get_client(self, env=None):
         """
         Returns python client object authenticated with multistack config.
+        For a group, a shell-style pattern or environments chosen with
+        select, a dictionary of client objects keyed by each environment is
+        returned instead.
         """
-        raise NotImplementedError()
+        env = env or self.client_env
+        if env is None:
+            # Chosen with select, so there is no single entry to resolve
+            if not self.run_config:
+                raise AttributeError('No environment has been chosen to '
+                                     'build a client for')
+            envs = [run_env for run_env, _ in self.run_config]
+        else:
+            envs = self.get_envs(env)
+            if envs == [env] and not config.is_env_group(self.client_config,
+                                                         env):
+                creds = dict(self.get_python_creds(env))
+                return self.make_client(self.get_session(env), creds)
+        self.prefetch_creds(envs)
+        return dict((member, self.get_client(member)) for member in envs)
 
-    def prep_python_creds(self):
+    def get_python_creds(self, env):
         """
-        Prepare credentials for python client instantiation.
+        Returns the resolved credentials of an environment as text.
         """
-        raise NotImplementedError()
+        creds = []
+        for param, value in self.prep_creds(env):
+            if isinstance(value, bytes):
+                value = value.decode('utf-8')
+            creds.append((param, value))
+        return creds
+
+    def prep_python_creds(self, env):
+        """
+        Prepare credentials for python client instantiation. Returns the
+        keyword arguments for the keystoneauth password plugin and for the
+        session.
+        """
+        creds = dict(self.get_python_creds(env))
+        auth_kwargs = {}
+        for kwarg, params in PYTHON_AUTH_PARAMS:
+            for param in params:
+                if creds.get(param):
+                    auth_kwargs[kwarg] = creds[param]
+                    break
+        session_kwargs = {}
+        if creds.get('OS_CACERT'):
+            session_kwargs['verify'] = creds['OS_CACERT']
+        if creds.get('OS_INSECURE', '').lower() in ('1', 'yes', 'true', 'on'):
+            session_kwargs['verify'] = False
+        if creds.get('OS_CERT'):
+            if creds.get('OS_KEY'):
+                session_kwargs['cert'] = (creds['OS_CERT'], creds['OS_KEY'])
+            else:
+                session_kwargs['cert'] = creds['OS_CERT']
+        return auth_kwargs, session_kwargs
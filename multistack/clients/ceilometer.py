@@ -26,7 +26,14 @@ class MultiCeilometer(MultiClient):
     def __init__(self):
         super(MultiCeilometer, self).__init__()
         self.default_executable = 'ceilometer'
+        self.python_client = ('ceilometerclient.client', 'Client', '2')
         self.prefix_list += ["ceilometer_", "ceilometerclient_"]
+        self.service_types = ['metering']
+        self.token_variables = ('OS_AUTH_TOKEN', 'CEILOMETER_URL')
+        self.read_only_commands = ['alarm-list', 'alarm-show', 'event-list',
+                                   'meter-list', 'resource-list',
+                                   'resource-show', 'sample-list',
+                                   'statistics']
 
 
 def main_client():
@@ -26,7 +26,14 @@ class MultiCinder(MultiClient):
     def __init__(self):
         super(MultiCinder, self).__init__()
         self.default_executable = 'cinder'
+        self.python_client = ('cinderclient.client', 'Client', '3')
         self.prefix_list += ["cinder_", "cinderclient_"]
+        self.service_types = ['volumev3', 'block-storage', 'volumev2',
+                              'volume']
+        self.token_variables = ('OS_AUTH_TOKEN', 'CINDERCLIENT_BYPASS_URL')
+        self.read_only_commands = ['list', 'show', 'backup-list', 'quota-show',
+                                   'snapshot-list', 'snapshot-show',
+                                   'type-list']
 
 
 def main_client():
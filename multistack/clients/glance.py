@@ -26,7 +26,11 @@ class MultiGlance(MultiClient):
     def __init__(self):
         super(MultiGlance, self).__init__()
         self.default_executable = 'glance'
+        self.python_client = ('glanceclient', 'Client', '2')
         self.prefix_list += ["glance_", "glanceclient_"]
+        self.service_types = ['image']
+        self.token_variables = ('OS_AUTH_TOKEN', 'OS_IMAGE_URL')
+        self.read_only_commands = ['image-list', 'image-show', 'member-list']
 
 
 def main_client():
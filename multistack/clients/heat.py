@@ -26,7 +26,13 @@ class MultiHeat(MultiClient):
     def __init__(self):
         super(MultiHeat, self).__init__()
         self.default_executable = 'heat'
+        self.python_client = ('heatclient.client', 'Client', '1')
         self.prefix_list += ["heat_", "heatclient_"]
+        self.service_types = ['orchestration']
+        self.token_variables = ('OS_AUTH_TOKEN', 'HEAT_URL')
+        self.read_only_commands = ['stack-list', 'stack-show', 'event-list',
+                                   'output-list', 'resource-list',
+                                   'resource-show']
 
 
 def main_client():
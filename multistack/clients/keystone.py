@@ -26,7 +26,12 @@ class MultiKeystone(MultiClient):
     def __init__(self):
         super(MultiKeystone, self).__init__()
         self.default_executable = 'keystone'
+        self.python_client = ('keystoneclient.client', 'Client', None)
         self.prefix_list += ["keystone_", "keystoneclient_"]
+        self.service_types = ['identity']
+        self.token_variables = ('OS_SERVICE_TOKEN', 'OS_SERVICE_ENDPOINT')
+        self.read_only_commands = ['catalog', 'endpoint-list', 'role-list',
+                                   'service-list', 'tenant-list', 'user-list']
 
 
 def main_client():
@@ -26,7 +26,13 @@ class MultiNeutron(MultiClient):
     def __init__(self):
         super(MultiNeutron, self).__init__()
         self.default_executable = 'neutron'
+        self.python_client = ('neutronclient.v2_0.client', 'Client', None)
         self.prefix_list += ["neutron_", "neutronclient_"]
+        self.service_types = ['network']
+        self.token_variables = ('OS_TOKEN', 'OS_URL')
+        self.read_only_commands = ['floatingip-list', 'net-list', 'net-show',
+                                   'port-list', 'port-show', 'router-list',
+                                   'security-group-list', 'subnet-list']
 
 
 def main_client():
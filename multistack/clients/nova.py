@@ -26,7 +26,14 @@ class MultiNova(MultiClient):
     def __init__(self):
         super(MultiNova, self).__init__()
         self.default_executable = 'nova'
+        self.python_client = ('novaclient.client', 'Client', '2')
         self.prefix_list += ["nova_", "novaclient_"]
+        self.service_types = ['compute']
+        self.token_variables = ('OS_TOKEN', 'OS_ENDPOINT_OVERRIDE')
+        self.read_only_commands = ['list', 'show', 'availability-zone-list',
+                                   'flavor-list', 'hypervisor-list',
+                                   'image-list', 'keypair-list', 'limits',
+                                   'quota-show', 'usage']
 
 
 def main_client():
@@ -26,7 +26,13 @@ class MultiOpenstack(MultiClient):
     def __init__(self):
         super(MultiOpenstack, self).__init__()
         self.default_executable = 'openstack'
+        self.python_client = ('openstack.connection', 'Connection', None)
         self.prefix_list += ["openstack_", "openstackclient_"]
+        self.read_only_commands = ['catalog list', 'endpoint list',
+                                   'flavor list', 'image list', 'image show',
+                                   'network list', 'port list', 'project list',
+                                   'server list', 'server show', 'stack list',
+                                   'subnet list', 'volume list', 'volume show']
 
 
 def main_client():
@@ -26,7 +26,9 @@ class MultiSolum(MultiClient):
     def __init__(self):
         super(MultiSolum, self).__init__()
         self.default_executable = 'solum'
+        self.python_client = ('solumclient.client', 'Client', '1')
         self.prefix_list += ["solum_", "solumclient_"]
+        self.read_only_commands = ['app list', 'app show', 'languagepack list']
 
 
 def main_client():
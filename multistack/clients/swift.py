@@ -27,6 +27,16 @@ class MultiSwift(MultiClient):
         super(MultiSwift, self).__init__()
         self.default_executable = 'swift'
         self.prefix_list += ["swift_", "swiftclient_"]
+        self.service_types = ['object-store']
+        self.token_variables = ('OS_AUTH_TOKEN', 'OS_STORAGE_URL')
+        self.read_only_commands = ['list', 'stat']
+
+    def make_client(self, session, creds):
+        from swiftclient import client
+        os_options = {}
+        if creds.get('OS_REGION_NAME'):
+            os_options['region_name'] = creds['OS_REGION_NAME']
+        return client.Connection(session=session, os_options=os_options)
 
 
 def main_client():
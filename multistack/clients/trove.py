@@ -26,7 +26,12 @@ class MultiTrove(MultiClient):
     def __init__(self):
         super(MultiTrove, self).__init__()
         self.default_executable = 'trove'
+        self.python_client = ('troveclient.client', 'Client', '1.0')
         self.prefix_list += ["trove_", "troveclient_"]
+        self.service_types = ['database']
+        self.token_variables = ('OS_AUTH_TOKEN', 'TROVE_BYPASS_URL')
+        self.read_only_commands = ['list', 'show', 'backup-list',
+                                   'datastore-list', 'flavor-list']
 
 
 def main_client():
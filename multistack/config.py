@@ -22,27 +22,511 @@ try:
 except:
     import configparser as ConfigParser
 
+try:
+    from StringIO import StringIO
+except:
+    from io import StringIO
+
+import bisect
+import fnmatch
+import glob
+import json
 import os
+import re
+import zlib
+
+# Bump this whenever the layout of the compiled cache changes
+CACHE_VERSION = 3
+
+# Files read from the fragment directories, and the directive that pulls
+# another file or pattern of files into a fragment
+FRAGMENT_SUFFIX = '.conf'
+INCLUDE_DIRECTIVE = '%include'
+
+# Environment variable pointing the clients at a running multistack-agent
+AGENT_SOCKET_ENV = 'MULTISTACK_AGENT_SOCK'
+
+
+class CompiledConfig(object):
+    """
+    A read-only, pre-indexed copy of the multistack configuration. It answers
+    the same questions as the RawConfigParser it was compiled from, and also
+    knows each section's group members, options by prefix and tags.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.options = data['options']
+        self.groups = data['groups']
+        self.prefixes = data['prefixes']
+        self.tags = data['tags']
+        self.names = sorted(self.options)
+        self.expanded = {}
+
+    @classmethod
+    def compile(cls, parser):
+        return cls.compile_sections([(section, parser.items(section))
+                                     for section in parser.sections()])
 
+    @classmethod
+    def compile_sections(cls, sections):
+        """
+        Compiles a list of (section, items) pairs, where the items are the
+        (param, value) pairs RawConfigParser returns.
+        """
+        options = {}
+        groups = {}
+        prefixes = {}
+        tags = {}
+        for section, items in sections:
+            options[section] = [[param, value] for param, value in items]
+            values = dict(items)
+            if 'multistack_group' in values:
+                members = values['multistack_group'].split(',')
+                groups[section] = sorted(list(set(members)))
+            if 'multistack_tags' in values:
+                for tag in values['multistack_tags'].split(','):
+                    if tag.strip():
+                        tags.setdefault(tag.strip(), []).append(section)
+            index = prefixes[section] = {}
+            for param, value in items:
+                if '_' in param:
+                    prefix = param[:param.index('_') + 1]
+                    index.setdefault(prefix, []).append([param, value])
+        return cls({'options': options, 'groups': groups,
+                    'prefixes': prefixes, 'tags': tags})
 
-def load_multistack_config():
+    def expand_group(self, group, path=None):
+        """
+        Returns the environments in a group with nested groups expanded and
+        duplicates removed. Expansions are remembered, so every group is only
+        expanded once however many groups include it.
+        """
+        if group in self.expanded:
+            return self.expanded[group]
+        path = (path or []) + [group]
+        members = set()
+        for member in self.groups[group]:
+            if member in path:
+                msg = ('Group \'%s\' contains itself: %s' %
+                       (member, ' -> '.join(path + [member])))
+                raise AttributeError(msg)
+            if member not in self.options:
+                msg = ('Group member \'%s\' is not in the multistack '
+                       'configuration file' % member)
+                raise AttributeError(msg)
+            if member in self.groups:
+                members.update(self.expand_group(member, path))
+            else:
+                members.add(member)
+        self.expanded[group] = sorted(members)
+        return self.expanded[group]
+
+    def glob(self, pattern):
+        """
+        Returns the sections whose names match a shell-style pattern. Only
+        the sections sharing the pattern's literal prefix are looked at.
+        """
+        prefix = re.split(r'[*?\[]', pattern, 1)[0]
+        start = bisect.bisect_left(self.names, prefix)
+        matches = []
+        for name in self.names[start:]:
+            if not name.startswith(prefix):
+                break
+            if fnmatch.fnmatchcase(name, pattern):
+                matches.append(name)
+        return matches
+
+    def match(self, regex):
+        """
+        Returns the sections whose names match a regular expression.
+        """
+        try:
+            name_re = re.compile(regex)
+        except re.error as e:
+            raise AttributeError('Invalid pattern \'%s\': %s' % (regex, e))
+        return [name for name in self.names if name_re.search(name)]
+
+    def select_tags(self, expression):
+        """
+        Returns the sections matching a tag expression such as
+        'region:us and (tier:prod or tier:stage) and not legacy'.
+        """
+        return sorted(TagExpression(expression).evaluate(self))
+
+    def sections(self):
+        return list(self.options)
+
+    def has_section(self, section):
+        return section in self.options
+
+    def items(self, section):
+        if section not in self.options:
+            raise ConfigParser.NoSectionError(section)
+        return [tuple(item) for item in self.options[section]]
+
+    def has_option(self, section, option):
+        option = option.lower()
+        return any(param == option
+                   for param, _ in self.options.get(section, []))
+
+    def get(self, section, option):
+        option = option.lower()
+        for param, value in self.items(section):
+            if param == option:
+                return value
+        raise ConfigParser.NoOptionError(option, section)
+
+    def prefixed_items(self, section, prefix_list):
+        """
+        Returns the options of a section that start with one of the prefixes.
+        """
+        index = self.prefixes.get(section, {})
+        items = []
+        for prefix in prefix_list:
+            if prefix.count('_') == 1 and prefix.endswith('_'):
+                items.extend(tuple(item) for item in index.get(prefix, []))
+            else:
+                items.extend(item for item in self.items(section)
+                             if item[0].startswith(prefix) and
+                             item not in items)
+        return items
+
+
+class TagExpression(object):
     """
-    Pulls the multistack configuration file and reads it
+    A boolean combination of tags using and, or, not and parentheses. Tags
+    next to each other without an operator are and-ed together.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = re.findall(r'\(|\)|[^\s()]+', expression)
+        self.position = 0
+
+    def error(self, msg):
+        raise AttributeError('Invalid tag expression \'%s\': %s' %
+                             (self.expression, msg))
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def evaluate(self, client_config):
+        self.config = client_config
+        self.everything = set(client_config.names)
+        self.position = 0
+        if not self.tokens:
+            self.error('it is empty')
+        result = self.parse_or()
+        if self.peek() is not None:
+            self.error('unexpected \'%s\'' % self.peek())
+        return result
+
+    def parse_or(self):
+        result = self.parse_and()
+        while self.peek() == 'or':
+            self.take()
+            result = result | self.parse_and()
+        return result
+
+    def parse_and(self):
+        result = self.parse_not()
+        while self.peek() not in (None, 'or', ')'):
+            if self.peek() == 'and':
+                self.take()
+            result = result & self.parse_not()
+        return result
+
+    def parse_not(self):
+        if self.peek() == 'not':
+            self.take()
+            return self.everything - self.parse_not()
+        return self.parse_term()
+
+    def parse_term(self):
+        token = self.take()
+        if token is None:
+            self.error('it ends too early')
+        if token == '(':
+            result = self.parse_or()
+            if self.take() != ')':
+                self.error('missing \')\'')
+            return result
+        if token in ('and', 'or', ')'):
+            self.error('unexpected \'%s\'' % token)
+        return set(self.config.tags.get(token, []))
+
+
+def config_paths():
+    """
+    Returns the locations the multistack configuration is read from.
     """
     xdg_config_home = os.environ.get('XDG_CONFIG_HOME') or \
         os.path.expanduser('~/.config')
-    possible_configs = [os.path.join(xdg_config_home, "multistack"),
-                        os.path.expanduser("~/.multistack"),
-                        ".multistack"]
-    multistack_config = ConfigParser.RawConfigParser()
-    multistack_config.read(possible_configs)
-    return multistack_config
+    return [os.path.join(xdg_config_home, "multistack"),
+            os.path.expanduser("~/.multistack"),
+            os.path.abspath(".multistack")]
+
+
+def fragment_dirs():
+    """
+    Returns the directories holding configuration fragments.
+    """
+    xdg_config_home = os.environ.get('XDG_CONFIG_HOME') or \
+        os.path.expanduser('~/.config')
+    return [os.path.join(xdg_config_home, "multistack.d"),
+            os.path.expanduser("~/.multistack.d")]
+
+
+def file_signature(path):
+    """
+    Returns the mtime and size of a file, which changes whenever it is
+    edited, added or removed.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return [None, None]
+    return [getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_size]
+
+
+def config_signature(paths):
+    """
+    Returns the mtime and size of each path.
+    """
+    return [[path] + file_signature(path) for path in paths]
+
+
+def list_fragments(directory):
+    """
+    Returns the fragment files in a directory in the order they are read.
+    """
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return [os.path.join(directory, name) for name in sorted(names)
+            if name.endswith(FRAGMENT_SUFFIX) and not name.startswith('.')]
+
+
+def expand_include(pattern, source):
+    """
+    Returns the files an include directive in source refers to. Relative
+    paths are relative to the directory of source, a directory stands for
+    the fragments in it, and shell-style patterns are expanded.
+    """
+    path = os.path.expanduser(pattern)
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(source), path)
+    if any(char in path for char in '*?['):
+        return sorted(match for match in glob.glob(path)
+                      if os.path.isfile(match))
+    if os.path.isdir(path):
+        return list_fragments(path)
+    if not os.path.isfile(path):
+        msg = ('%s includes \'%s\', which does not exist' %
+               (source, pattern))
+        raise AttributeError(msg)
+    return [path]
+
+
+def read_fragment(path, signature):
+    """
+    Parses one fragment. Returns its signature, the include directives in
+    it and its sections as [section, items] pairs.
+    """
+    includes = []
+    lines = []
+    try:
+        with open(path) as fragment_file:
+            for line in fragment_file:
+                if line.startswith(INCLUDE_DIRECTIVE):
+                    includes.append(line[len(INCLUDE_DIRECTIVE):].strip())
+                    # Keep the line numbers of parse errors right
+                    line = '\n'
+                lines.append(line)
+    except (IOError, OSError) as e:
+        raise AttributeError('Could not read %s: %s' % (path, e))
+    parser = ConfigParser.RawConfigParser()
+    read_file = getattr(parser, 'read_file', None) or parser.readfp
+    try:
+        read_file(StringIO(''.join(lines)), path)
+    except ConfigParser.Error as e:
+        raise AttributeError('Could not read %s: %s' % (path, e))
+    sections = [[section, [list(item) for item in parser.items(section)]]
+                for section in parser.sections()]
+    return {'signature': signature, 'includes': includes,
+            'sections': sections}
+
+
+def read_main_config(paths, signature):
+    """
+    Parses the main configuration files, which are read together so that a
+    later file can add to the sections of an earlier one.
+    """
+    parser = ConfigParser.RawConfigParser()
+    parser.read(paths)
+    sections = [[section, [list(item) for item in parser.items(section)]]
+                for section in parser.sections()]
+    return {'signature': signature, 'includes': [], 'sections': sections}
+
+
+def cache_path(paths):
+    """
+    Returns where the compiled configuration for a set of paths is cached.
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.expanduser('~/.cache')
+    digest = zlib.crc32('\0'.join(paths).encode('utf-8')) & 0xffffffff
+    return os.path.join(cache_home, 'multistack', 'config-%08x.json' %
+                        digest)
+
+
+def load_cache(path):
+    """
+    Returns the cached configuration, or an empty one if there is no usable
+    cache.
+    """
+    try:
+        with open(path) as cache_file:
+            cached = json.load(cache_file)
+    except (IOError, OSError, ValueError):
+        return {}
+    if cached.get('version') != CACHE_VERSION:
+        return {}
+    return cached
+
+
+def save_cache(path, cached):
+    """
+    Writes the compiled configuration to the cache. The cache holds the
+    plain text of the configuration, so it is only readable by the user.
+    Failing to write it is not an error.
+    """
+    import tempfile
+    try:
+        cache_dir = os.path.dirname(path)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'w') as cache_file:
+            json.dump(cached, cache_file)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+
+def merge_sections(units):
+    """
+    Returns the sections of every parsed file in order. A section may only
+    be defined by one of the main configuration or the fragments.
+    """
+    owners = {}
+    sections = []
+    for source, unit in units:
+        for section, items in unit['sections']:
+            if section in owners:
+                msg = ('Section \'%s\' is defined in both %s and %s' %
+                       (section, owners[section], source))
+                raise AttributeError(msg)
+            owners[section] = source
+            sections.append((section, [tuple(item) for item in items]))
+    return sections
+
+
+def load_multistack_config(use_cache=True):
+    """
+    Pulls the multistack configuration file and its fragments and reads them
+
+    The compiled configuration is cached along with the mtime, size and
+    includes of every file it was read from. The sections of each file are
+    cached separately, so that when some files change only those are parsed
+    again, and the sections are only loaded when something did change.
+    Without use_cache every file is parsed, and the cache is rewritten.
+
+    Only the locations that exist are part of the cache's name, so running
+    from a directory without a .multistack of its own doesn't add a copy of
+    the configuration to the cache.
+    """
+    possible_configs = []
+    for config_path in config_paths():
+        # The local file is the one in the home directory when run from it
+        if os.path.exists(config_path) and \
+                config_path not in possible_configs:
+            possible_configs.append(config_path)
+    directories = [directory for directory in fragment_dirs()
+                   if os.path.isdir(directory)]
+    path = cache_path(possible_configs + directories)
+    sections_path = path[:-len('.json')] + '-sections.json'
+    cached = load_cache(path) if use_cache else {}
+    cached_files = cached.get('files', {})
+    parsed = {}
+
+    def read(key, signature, reader):
+        info = cached_files.get(key)
+        if info is None or info['signature'] != signature:
+            parsed[key] = reader(signature)
+            return parsed[key]
+        return info
+
+    files = {}
+    signature = config_signature(possible_configs)
+    files['main'] = read('main', signature, lambda signature:
+                         read_main_config(possible_configs, signature))
+    order = ['main']
+
+    # Fragments and the files they include, each read once
+    pending = []
+    for directory in directories:
+        pending.extend(list_fragments(directory))
+    pending.reverse()
+    while pending:
+        fragment = os.path.realpath(pending.pop())
+        if fragment in files:
+            continue
+        files[fragment] = read(fragment, file_signature(fragment),
+                               lambda signature: read_fragment(fragment,
+                                                               signature))
+        order.append(fragment)
+        for include in reversed(files[fragment]['includes']):
+            pending.extend(reversed(expand_include(include, fragment)))
+
+    if not parsed and cached.get('order') == order:
+        return CompiledConfig(cached['config'])
+
+    # Fill in the sections of the files that didn't change
+    sections = load_cache(sections_path).get('sections', {})
+    units = []
+    for key in order:
+        if key in parsed:
+            sections[key] = parsed[key]['sections']
+        elif key not in sections:
+            # The sections cache is missing or stale, read every file again
+            return load_multistack_config(use_cache=False)
+        source = 'the main configuration' if key == 'main' else key
+        units.append((source, {'sections': sections[key]}))
+    compiled = CompiledConfig.compile_sections(merge_sections(units))
+
+    files = dict((key, {'signature': files[key]['signature'],
+                        'includes': files[key]['includes']})
+                 for key in order)
+    save_cache(sections_path, {'version': CACHE_VERSION, 'sections':
+                               dict((key, sections[key]) for key in order)})
+    save_cache(path, {'version': CACHE_VERSION, 'order': order,
+                      'files': files, 'config': compiled.data})
+    return compiled
 
 
 def is_env_group(client_config, env):
-    return client_config.has_option(env, 'MULTISTACK_GROUP')
+    return env in client_config.groups
 
 
 def get_group_members(client_config, env):
-    members = client_config.get(env, 'MULTISTACK_GROUP').split(',')
-    return sorted(list(set(members)))  # Remove duplicates
+    return client_config.expand_group(env)
@@ -15,7 +15,19 @@
 #   limitations under the License.
 #
 
-import keyring
+import re
+
+# How the configuration refers to a credential kept under a global id
+KEYRING_REFERENCE = "USE_KEYRING\\[([\x27\x22])(.*)\\1\\]"
+
+
+def _keyring():
+    """
+    Imports keyring when a credential is first needed. Loading keyring and
+    discovering its backends is slow, and most runs never touch it.
+    """
+    import keyring
+    return keyring
 
 
 def password_get(env, parameter):
@@ -25,7 +37,8 @@ def password_get(env, parameter):
     """
     username = '%s:%s' % (env, parameter)
     try:
-        return keyring.get_password('multistack', username).encode('ascii')
+        password = _keyring().get_password('multistack', username)
+        return password.encode('utf-8')
     except:
         return False
 
@@ -37,7 +50,7 @@ def password_set(env, parameter, password):
     """
     username = '%s:%s' % (env, parameter)
     try:
-        keyring.set_password('multistack', username, password)
+        _keyring().set_password('multistack', username, password)
         return True
     except:
         return False
@@ -50,7 +63,36 @@ def password_delete(env, parameter):
     """
     username = '%s:%s' % (env, parameter)
     try:
-        keyring.delete_password('multistack', username)
+        _keyring().delete_password('multistack', username)
         return True
     except:
         return False
+
+
+def keyring_key(env, param, value):
+    """
+    Returns the (env, parameter) pair a configuration value should be looked
+    up under in the keyring, or None if the value doesn't come from the
+    keyring.
+    """
+    if not value.startswith("USE_KEYRING"):
+        return None
+    if value == "USE_KEYRING":
+        return (env, param)
+    global_id = re.match(KEYRING_REFERENCE, value).group(2)
+    return ('global', global_id)
+
+
+def write_workers(workers):
+    """
+    Returns how many credentials can be written to the keyring at once.
+    Backends that keep every credential in one file rewrite all of it on
+    each change, so they are written to one at a time.
+    """
+    try:
+        backend = _keyring().get_keyring()
+    except Exception:
+        return 1
+    if hasattr(backend, 'file_path'):
+        return 1
+    return workers
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Runs jobs across a bounded pool of worker threads
+"""
+try:
+    import Queue as queue
+except:
+    import queue
+
+import os
+import signal
+import sys
+import threading
+import time
+
+# Seconds a client gets to exit after SIGTERM before it is sent SIGKILL
+KILL_GRACE = 5
+
+
+class Limiter(object):
+    """
+    Caps how many jobs sharing a key run at once and how many of them are
+    started per second, using a token bucket for each key. Limits are given
+    as dictionaries keyed by the job keys; keys without one aren't limited.
+    """
+
+    def __init__(self, concurrency=None, rate=None):
+        self.concurrency = concurrency or {}
+        self.rate = rate or {}
+        self.running = {}
+        self.tokens = {}
+        self.updated = {}
+
+    def wait_time(self, key, now):
+        """
+        Returns 0 if a job for the key can start now, the seconds until one
+        can if it's waiting on the start rate, or None if it has to wait for
+        a running job to finish.
+        """
+        limit = self.concurrency.get(key)
+        if limit is not None and self.running.get(key, 0) >= limit:
+            return None
+        rate = self.rate.get(key)
+        if not rate:
+            return 0
+        # Allow a burst of up to a second's worth of starts
+        capacity = max(1.0, rate)
+        tokens = self.tokens.get(key, capacity)
+        tokens = min(capacity,
+                     tokens + (now - self.updated.get(key, now)) * rate)
+        self.tokens[key] = tokens
+        self.updated[key] = now
+        if tokens >= 1:
+            return 0
+        return (1 - tokens) / rate
+
+    def start(self, key):
+        self.running[key] = self.running.get(key, 0) + 1
+        if self.rate.get(key):
+            self.tokens[key] -= 1
+
+    def finish(self, key):
+        self.running[key] -= 1
+
+
+class LimitedQueue(object):
+    """
+    Hands out jobs to workers in order, except that a job whose key is at
+    its limit is passed over for the next job that can start.
+    """
+
+    def __init__(self, jobs, keys, limiter):
+        self.limiter = limiter
+        self.keys = keys
+        self.pending = {}
+        self.order = []
+        for index, job in enumerate(jobs):
+            if keys[index] not in self.pending:
+                self.pending[keys[index]] = []
+                self.order.append(keys[index])
+            self.pending[keys[index]].append((index, job))
+        self.condition = threading.Condition()
+
+    def get(self):
+        with self.condition:
+            while True:
+                if not self.order:
+                    return None
+                now = time.time()
+                wait = None
+                for key in self.order:
+                    key_wait = self.limiter.wait_time(key, now)
+                    if key_wait == 0:
+                        self.limiter.start(key)
+                        item = self.pending[key].pop(0)
+                        if not self.pending[key]:
+                            del self.pending[key]
+                            self.order.remove(key)
+                        return item
+                    if key_wait is not None:
+                        wait = key_wait if wait is None else min(wait,
+                                                                 key_wait)
+                self.condition.wait(wait)
+
+    def done(self, index):
+        with self.condition:
+            self.limiter.finish(self.keys[index])
+            self.condition.notify_all()
+
+
+class SimpleQueue(object):
+    """
+    Hands out jobs to workers in order.
+    """
+
+    def __init__(self, jobs):
+        self.pending = queue.Queue()
+        for index, job in enumerate(jobs):
+            self.pending.put((index, job))
+
+    def get(self):
+        try:
+            return self.pending.get_nowait()
+        except queue.Empty:
+            return None
+
+    def done(self, index):
+        pass
+
+
+def run_jobs(func, jobs, workers=1, keys=None, limiter=None):
+    """
+    Calls func once for each job using up to workers threads and returns the
+    results in the same order as the jobs were given. With a limiter, each
+    job's key from keys decides which of the limiter's limits it is held to.
+    """
+    jobs = list(jobs)
+    if limiter is None and (workers <= 1 or len(jobs) <= 1):
+        return [func(job) for job in jobs]
+
+    results = [None] * len(jobs)
+    errors = []
+    if limiter is None:
+        pending = SimpleQueue(jobs)
+    else:
+        pending = LimitedQueue(jobs, keys, limiter)
+
+    def worker():
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            index, job = item
+            try:
+                results[index] = func(job)
+            except Exception:
+                errors.append(sys.exc_info())
+            finally:
+                pending.done(index)
+
+    threads = []
+    for i in range(max(1, min(workers, len(jobs)))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    # Surface the first failure in the calling thread
+    if errors:
+        raise errors[0][1]
+    return results
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Watchdog(object):
+    """
+    Stops a process once it has run for timeout seconds. The process is sent
+    SIGTERM and, if it is still around grace seconds later, SIGKILL. When
+    the process was started in its own process group, the whole group is
+    signalled so anything the client started goes with it.
+    """
+
+    def __init__(self, process, timeout, group=False, grace=KILL_GRACE):
+        self.process = process
+        self.group = group
+        self.grace = grace
+        self.fired = False
+        self.timers = []
+        if timeout is not None:
+            self.start_timer(max(timeout, 0), self.expire)
+
+    def start_timer(self, delay, func, *args):
+        timer = threading.Timer(delay, func, args)
+        timer.daemon = True
+        timer.start()
+        self.timers.append(timer)
+
+    def expire(self):
+        self.fired = True
+        self.terminate()
+
+    def terminate(self):
+        self.send(signal.SIGTERM)
+        self.start_timer(self.grace, self.send, getattr(signal, 'SIGKILL',
+                                                        signal.SIGTERM))
+
+    def send(self, sig):
+        try:
+            if self.group:
+                os.killpg(self.process.pid, sig)
+            elif self.process.poll() is None:
+                self.process.send_signal(sig)
+        except OSError:
+            # It's already gone
+            pass
+
+    def cancel(self):
+        for timer in self.timers:
+            timer.cancel()
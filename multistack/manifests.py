@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Reads manifests of keyring changes and writes encrypted exports of the
+credentials kept in the keyring
+
+A manifest is a list of entries, each with an env, a parameter and where its
+value comes from:
+
+    source  value
+    value   the credential itself (the default)
+    env     the name of an environment variable holding it
+    file    the path of a file holding it
+    delete  nothing, the credential is deleted
+
+Manifests can be written as JSON, YAML or CSV. An export holds the same
+entries with their values, encrypted with a key derived from a passphrase.
+"""
+from __future__ import absolute_import
+
+import io
+import json
+import os
+import sys
+
+MANIFEST_FORMATS = ['json', 'yaml', 'csv']
+VALUE_SOURCES = ['value', 'env', 'file', 'delete']
+
+EXPORT_VERSION = 1
+# Iterations of PBKDF2-SHA256 used to turn a passphrase into a key
+EXPORT_ITERATIONS = 390000
+
+
+def detect_format(path, manifest_format=None):
+    """
+    Returns the format of a manifest, from its extension unless one is
+    given. Manifests read from stdin are JSON by default.
+    """
+    if manifest_format:
+        return manifest_format
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.yaml', '.yml'):
+        return 'yaml'
+    if extension == '.csv':
+        return 'csv'
+    return 'json'
+
+
+def parse_manifest(data, manifest_format):
+    """
+    Returns the entries of a manifest as a list of dictionaries. JSON and
+    YAML manifests are either a list of entries or a mapping with the list
+    under credentials.
+    """
+    if manifest_format == 'csv':
+        import csv
+        return list(csv.DictReader(io.StringIO(data)))
+    if manifest_format == 'yaml':
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError('PyYAML is needed to read YAML manifests, '
+                              'install it with pip install multistack[yaml]')
+        try:
+            entries = yaml.safe_load(data)
+        except yaml.YAMLError as e:
+            raise AttributeError('The manifest is not valid YAML: %s' % e)
+    else:
+        try:
+            entries = json.loads(data)
+        except ValueError as e:
+            raise AttributeError('The manifest is not valid JSON: %s' % e)
+    if isinstance(entries, dict):
+        entries = entries.get('credentials')
+    if not isinstance(entries, list):
+        raise AttributeError('The manifest must be a list of entries')
+    return entries
+
+
+def read_manifest(path, manifest_format=None):
+    """
+    Reads a manifest from a file, or stdin if the path is -.
+    """
+    manifest_format = detect_format(path, manifest_format)
+    try:
+        if path == '-':
+            data = sys.stdin.read()
+        else:
+            with io.open(path, encoding='utf-8', newline='') as manifest_file:
+                data = manifest_file.read()
+    except (IOError, OSError) as e:
+        raise AttributeError('Cannot read manifest: %s' % e)
+    return parse_manifest(data, manifest_format)
+
+
+def resolve_value(entry):
+    """
+    Returns the credential an entry sets, or None if it deletes one.
+    """
+    source = entry.get('source') or 'value'
+    value = entry.get('value')
+    if source == 'delete':
+        return None
+    if value is None or value == '':
+        raise ValueError('it has no value')
+    value = '%s' % value
+    if source == 'env':
+        if not os.environ.get(value):
+            raise ValueError('the environment variable %s is not set' % value)
+        return os.environ[value]
+    if source == 'file':
+        try:
+            with io.open(os.path.expanduser(value),
+                         encoding='utf-8') as value_file:
+                value = value_file.read().rstrip('\r\n')
+        except (IOError, OSError) as e:
+            raise ValueError('cannot read %s: %s' % (value, e))
+        if not value:
+            raise ValueError('%s is empty' % entry['value'])
+    return value
+
+
+def resolve_manifest(entries, envs=None):
+    """
+    Checks every entry and returns them as (env, parameter, value) tuples,
+    with a value of None for deletions. Nothing is returned unless every
+    entry is valid, so a bad manifest doesn't leave the keyring half
+    changed. With envs, only the entries for those environments are kept.
+    """
+    changes = []
+    for number, entry in enumerate(entries, 1):
+        try:
+            if not isinstance(entry, dict):
+                raise ValueError('it is not a mapping')
+            env = entry.get('env')
+            parameter = entry.get('parameter')
+            if not env or not parameter:
+                raise ValueError('it needs an env and a parameter')
+            if (entry.get('source') or 'value') not in VALUE_SOURCES:
+                raise ValueError('its source must be one of %s' %
+                                 ', '.join(VALUE_SOURCES))
+            if envs and env not in envs:
+                continue
+            changes.append(('%s' % env, '%s' % parameter,
+                            resolve_value(entry)))
+        except ValueError as e:
+            raise AttributeError('Manifest entry %d can\'t be used: %s' %
+                                 (number, e))
+    return changes
+
+
+def keyring_references(client_config, envs=None):
+    """
+    Returns the (env, parameter) pairs of every credential the configuration
+    keeps in the keyring, or only those used by envs.
+    """
+    from . import credentials
+
+    keys = set()
+    for section in client_config.sections():
+        if envs and section not in envs:
+            continue
+        for param, value in client_config.items(section):
+            key = credentials.keyring_key(section, param.upper(), value)
+            if key:
+                keys.add(key)
+    return sorted(keys)
+
+
+def _fernet(passphrase, salt, iterations):
+    import base64
+
+    try:
+        from cryptography.fernet import Fernet
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    except ImportError:
+        raise ImportError('cryptography is needed to export and import '
+                          'credentials, install it with pip install '
+                          'multistack[export]')
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt,
+                     iterations=iterations, backend=default_backend())
+    key = kdf.derive(passphrase.encode('utf-8'))
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def encrypt_export(changes, passphrase):
+    """
+    Returns an export of (env, parameter, value) credentials, encrypted with
+    the passphrase.
+    """
+    import base64
+
+    salt = os.urandom(16)
+    entries = [{'env': env, 'parameter': parameter, 'value': value}
+               for env, parameter, value in changes]
+    data = json.dumps({'credentials': entries}).encode('utf-8')
+    token = _fernet(passphrase, salt, EXPORT_ITERATIONS).encrypt(data)
+    return json.dumps({'format': EXPORT_VERSION, 'cipher': 'fernet',
+                       'kdf': 'pbkdf2-sha256',
+                       'iterations': EXPORT_ITERATIONS,
+                       'salt': base64.b64encode(salt).decode('ascii'),
+                       'data': token.decode('ascii')}, indent=2) + '\n'
+
+
+def decrypt_export(data, passphrase):
+    """
+    Returns the manifest entries held in an encrypted export.
+    """
+    import base64
+
+    try:
+        export = json.loads(data)
+        if export.get('format') != EXPORT_VERSION:
+            raise ValueError('unknown format %s' % export.get('format'))
+        salt = base64.b64decode(export['salt'].encode('ascii'))
+        fernet = _fernet(passphrase, salt, int(export['iterations']))
+        token = export['data'].encode('ascii')
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise AttributeError('The file is not a multistack export: %s' % e)
+    from cryptography.fernet import InvalidToken
+    try:
+        data = fernet.decrypt(token)
+    except InvalidToken:
+        raise AttributeError('The passphrase is wrong or the export is '
+                             'damaged')
+    return parse_manifest(data.decode('utf-8'), 'json')
+
+
+def write_private(path, data):
+    """
+    Writes a file that only the current user can read.
+    """
+    if os.path.exists(path):
+        os.chmod(path, 0o600)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as private_file:
+        private_file.write(data)
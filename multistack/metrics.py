@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Exports how each environment did as Prometheus or StatsD metrics
+"""
+from __future__ import absolute_import
+
+import os
+import re
+import time
+
+STATSD_PORT = 8125
+STATSD_PREFIX = 'multistack'
+# Keep packets under the usual MTU so they aren't fragmented
+STATSD_PACKET_SIZE = 1400
+
+# name, type, help and how to get the value from an EnvResult
+PROMETHEUS_METRICS = [
+    ('multistack_run_duration_seconds', 'gauge',
+     'Seconds the client took in the environment, including retries.',
+     lambda result: result.duration),
+    ('multistack_run_exit_code', 'gauge',
+     'Exit status of the client, -1 if it could not be run.',
+     lambda result: -1 if result.returncode is None else result.returncode),
+    ('multistack_run_success', 'gauge',
+     'Whether the client succeeded in the environment.',
+     lambda result: 0 if result.failed else 1),
+    ('multistack_run_spawn_error', 'gauge',
+     'Whether the client could not be started in the environment.',
+     lambda result: 1 if result.error is not None and not result.skipped
+     else 0),
+    ('multistack_run_timed_out', 'gauge',
+     'Whether the client was stopped for running too long.',
+     lambda result: 1 if result.timed_out else 0),
+    ('multistack_run_attempts', 'gauge',
+     'Number of times the client was run in the environment.',
+     lambda result: result.attempts),
+]
+
+
+def _executable(result):
+    return os.path.basename(result.executable or '')
+
+
+def _labels(result):
+    labels = [('env', result.env), ('executable', _executable(result))]
+    # Batch runs have several runs per environment
+    if result.label != result.env:
+        labels.append(('run', result.label))
+    return labels
+
+
+def _format_labels(labels):
+    values = []
+    for name, value in labels:
+        value = ('%s' % value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n')
+        values.append('%s="%s"' % (name, value))
+    return '{%s}' % ','.join(values)
+
+
+def prometheus_lines(results, keyring_times, executable, now=None):
+    """
+    Returns the metrics of a run in the Prometheus text format. The
+    keyring times are the seconds spent looking up credentials, keyed by
+    the environment they were stored under.
+    """
+    lines = []
+    for name, kind, help, value in PROMETHEUS_METRICS:
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for result in results:
+            lines.append('%s%s %s' % (name, _format_labels(_labels(result)),
+                                      value(result)))
+    name = 'multistack_keyring_lookup_seconds'
+    lines.append('# HELP %s Seconds spent getting credentials from the '
+                 'keyring.' % name)
+    lines.append('# TYPE %s gauge' % name)
+    for env in sorted(keyring_times):
+        labels = [('env', env), ('executable', executable)]
+        lines.append('%s%s %s' % (name, _format_labels(labels),
+                                  keyring_times[env]))
+    name = 'multistack_last_run_timestamp_seconds'
+    lines.append('# HELP %s When the run finished.' % name)
+    lines.append('# TYPE %s gauge' % name)
+    lines.append('%s%s %s' % (name,
+                              _format_labels([('executable', executable)]),
+                              now or time.time()))
+    return lines
+
+
+def write_textfile(path, lines):
+    """
+    Writes metrics for the Prometheus node exporter's textfile collector.
+    The file is replaced in one go so the collector never reads half of it.
+    """
+    import tempfile
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.multistack-')
+    try:
+        with os.fdopen(fd, 'w') as metrics_file:
+            metrics_file.write('\n'.join(lines) + '\n')
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+def _statsd_name(*parts):
+    return '.'.join(re.sub(r'[^A-Za-z0-9_-]', '_', '%s' % part)
+                    for part in parts)
+
+
+def statsd_lines(results, keyring_times, executable):
+    """
+    Returns the metrics of a run as StatsD timers, counters and gauges named
+    multistack.<executable>.<env>.<metric>.
+    """
+    lines = []
+    for result in results:
+        name = _statsd_name(STATSD_PREFIX, _executable(result), result.label)
+        lines.append('%s.duration:%d|ms' % (name, result.duration * 1000))
+        lines.append('%s.runs:1|c' % name)
+        if result.failed:
+            lines.append('%s.failures:1|c' % name)
+        if result.error is not None and not result.skipped:
+            lines.append('%s.spawn_errors:1|c' % name)
+        if result.timed_out:
+            lines.append('%s.timeouts:1|c' % name)
+        if result.returncode is not None:
+            lines.append('%s.exit_code:%d|g' % (name, result.returncode))
+    for env in sorted(keyring_times):
+        name = _statsd_name(STATSD_PREFIX, executable, env)
+        lines.append('%s.keyring:%d|ms' % (name, keyring_times[env] * 1000))
+    return lines
+
+
+def parse_address(address):
+    """
+    Splits a StatsD address of host[:port] into a host and a port.
+    """
+    host, _, port = address.rpartition(':')
+    if not host:
+        return port, STATSD_PORT
+    try:
+        return host, int(port)
+    except ValueError:
+        msg = 'StatsD address \'%s\' must be host[:port]' % address
+        raise AttributeError(msg)
+
+
+def send_statsd(address, lines):
+    """
+    Sends metrics to StatsD over UDP, packing as many lines into each
+    packet as fit.
+    """
+    import socket
+
+    host, port = parse_address(address)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        packet = ''
+        for line in lines:
+            if packet and len(packet) + len(line) + 1 > STATSD_PACKET_SIZE:
+                sock.sendto(packet.encode('utf-8'), (host, port))
+                packet = ''
+            packet = packet + '\n' + line if packet else line
+        if packet:
+            sock.sendto(packet.encode('utf-8'), (host, port))
+    finally:
+        sock.close()
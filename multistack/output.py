@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Keeps the output of clients running against several environments apart
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import codecs
+import io
+import json
+import subprocess
+import sys
+import threading
+import time
+from . import utils
+
+OUTPUT_MODES = ['inherit', 'stream', 'replay']
+JSON_MODES = ['array', 'ndjson']
+
+# Key added to every merged JSON record to say where it came from
+JSON_ENV_KEY = 'Environment'
+
+# Output kept in memory per stream before it is spilled to a temp file
+SPOOL_MAX_SIZE = 1024 * 1024
+READ_SIZE = 64 * 1024
+
+
+def _binary(stream):
+    """
+    Returns the binary buffer underneath a text stream when there is one.
+    """
+    return getattr(stream, 'buffer', stream)
+
+
+class CapturedProcess(object):
+    """
+    Output that was captured elsewhere, with the pipes of a process.
+    """
+
+    def __init__(self, stdout, stderr):
+        self.stdout = io.BytesIO(stdout)
+        self.stderr = io.BytesIO(stderr)
+
+
+class OutputMultiplexer(object):
+    """
+    Routes the output of each environment's client to the terminal.
+
+    inherit: clients write straight to our stdout and stderr.
+    stream:  output is printed as it arrives with each line prefixed by the
+             environment's name.
+    replay:  output is held per environment and printed as one block per
+             environment, in the order the environments were given, as soon
+             as each of them has finished.
+    """
+
+    def __init__(self, envs, mode='inherit', stdout=None, stderr=None):
+        if mode not in OUTPUT_MODES:
+            msg = ('Output mode \'%s\' is not one of %s' %
+                   (mode, ', '.join(OUTPUT_MODES)))
+            raise AttributeError(msg)
+        self.mode = mode
+        self.envs = list(envs)
+        self.stdout = stdout or sys.stdout
+        self.stderr = stderr or sys.stderr
+        self.lock = threading.Lock()
+        self.spools = {}
+        self.headers = {}
+        self.errors = {}
+        # Environments whose last output couldn't be understood
+        self.invalid = set()
+        self.finished = set()
+        self.replayed = 0
+        # Where notices and the summary that aren't client output go
+        self.notices = self.stdout
+
+    def popen_kwargs(self):
+        """
+        Returns the stdout and stderr arguments to spawn a client with.
+        """
+        if self.mode == 'inherit':
+            return {'stdout': self.stdout, 'stderr': self.stderr}
+        return {'stdout': subprocess.PIPE, 'stderr': subprocess.PIPE}
+
+    def notice(self, env, msg, title='MULTISTACK'):
+        """
+        Prints a notice about an environment unless it belongs in the
+        environment's replay block.
+        """
+        if self.mode == 'replay':
+            return
+        with self.lock:
+            utils.print_notice(msg, title=title, file=self.notices)
+            self.notices.flush()
+
+    def error(self, env, error):
+        """
+        Prints an error about an environment, holding it back for the
+        environment's replay block if needed.
+        """
+        if self.mode == 'replay':
+            self.errors[env] = error
+            return
+        with self.lock:
+            utils.print_error(error, exit=False)
+
+    def capture(self, env, process):
+        """
+        Reads a client's output until it closes its pipes and returns the
+        number of bytes it wrote.
+        """
+        if self.mode == 'inherit':
+            return None
+        if self.mode == 'replay':
+            import tempfile
+            # Only keep the output of the last attempt
+            for spool in self.spools.pop(env, ()):
+                spool.close()
+            self.spools[env] = (
+                tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE),
+                tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE))
+        counts = [0, 0]
+        readers = []
+        for index, pipe in enumerate([process.stdout, process.stderr]):
+            reader = threading.Thread(target=self._read,
+                                      args=(env, index, pipe, counts))
+            reader.daemon = True
+            reader.start()
+            readers.append(reader)
+        for reader in readers:
+            reader.join()
+        return sum(counts)
+
+    def feed(self, env, stdout, stderr):
+        """
+        Shows output that didn't come straight from a client, such as output
+        from the response cache, as if it did. Returns the number of bytes.
+        """
+        if self.mode != 'inherit':
+            return self.capture(env, CapturedProcess(stdout, stderr))
+        with self.lock:
+            for data, stream in [(stdout, self.stdout),
+                                 (stderr, self.stderr)]:
+                stream.flush()
+                target = _binary(stream)
+                target.write(data)
+                target.flush()
+        return len(stdout) + len(stderr)
+
+    def _read(self, env, index, pipe, counts):
+        if self.mode == 'stream':
+            target = _binary([self.stdout, self.stderr][index])
+        else:
+            target = self.spools[env][index]
+        prefix = ('[%s] ' % env).encode('utf-8')
+        line_start = True
+        for chunk in iter(lambda: pipe.readline(READ_SIZE), b''):
+            counts[index] += len(chunk)
+            if self.mode == 'replay':
+                target.write(chunk)
+                continue
+            with self.lock:
+                if line_start:
+                    target.write(prefix)
+                target.write(chunk)
+                target.flush()
+            line_start = chunk.endswith(b'\n')
+        pipe.close()
+        if self.mode == 'stream' and not line_start:
+            with self.lock:
+                target.write(b'\n')
+                target.flush()
+
+    def close(self):
+        """
+        Called once every environment has finished.
+        """
+        pass
+
+    def finish(self, env, title='MULTISTACK', msg=None):
+        """
+        Marks an environment as finished and replays every finished block
+        that is next in line.
+        """
+        if self.mode != 'replay':
+            return
+        with self.lock:
+            self.finished.add(env)
+            self.headers[env] = (title, msg)
+            while (self.replayed < len(self.envs) and
+                   self.envs[self.replayed] in self.finished):
+                self._replay(self.envs[self.replayed])
+                self.replayed += 1
+
+    def _replay(self, env):
+        title, msg = self.headers.pop(env)
+        if msg:
+            utils.print_notice(msg, title=title)
+        self.stdout.flush()
+        if env in self.errors:
+            utils.print_error(self.errors.pop(env), exit=False)
+        self.stderr.flush()
+        spools = self.spools.pop(env, ())
+        for spool, stream in zip(spools, [self.stdout, self.stderr]):
+            spool.seek(0)
+            target = _binary(stream)
+            for chunk in iter(lambda: spool.read(READ_SIZE), b''):
+                target.write(chunk)
+            target.flush()
+            spool.close()
+
+
+class JsonStream(object):
+    """
+    Decodes a JSON document as it arrives. The document is either a list of
+    records, which are returned one at a time as soon as each is complete,
+    or a single record.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder('utf-8')('replace')
+        self.state = 'start'
+
+    def feed(self, data, final=False):
+        """
+        Adds bytes to the document and returns the records completed by them.
+        """
+        self.buffer += self.text.decode(data, final)
+        records = []
+        while True:
+            self.buffer = self.buffer.lstrip()
+            if not self.buffer:
+                break
+            if self.state == 'start':
+                if self.buffer[0] == '[':
+                    self.buffer = self.buffer[1:]
+                    self.state = 'list'
+                    continue
+                self.state = 'single'
+            if self.state == 'list' and self.buffer[0] in ',]':
+                if self.buffer[0] == ']':
+                    self.state = 'done'
+                self.buffer = self.buffer[1:]
+                continue
+            if self.state == 'done':
+                raise ValueError('Unexpected data after the JSON document')
+            try:
+                record, end = self.decoder.raw_decode(self.buffer)
+            except ValueError:
+                if final:
+                    raise
+                break
+            # A number at the end of the buffer may not be complete yet
+            if end == len(self.buffer) and not final and \
+                    not isinstance(record, (dict, list)):
+                break
+            records.append(record)
+            self.buffer = self.buffer[end:]
+            if self.state == 'single':
+                self.state = 'done'
+        return records
+
+    def close(self):
+        """
+        Returns the last records once the whole document has been read.
+        """
+        records = self.feed(b'', final=True)
+        if self.state == 'list':
+            raise ValueError('The JSON list was not closed')
+        return records
+
+
+class JsonMultiplexer(OutputMultiplexer):
+    """
+    Parses each client's output as JSON and merges the records of every
+    environment into a single document on stdout, tagging each record with
+    its environment. Records are written as soon as they are parsed, either
+    as one JSON list (array) or as one record per line (ndjson). Everything
+    else, including the clients' stderr, goes to stderr.
+    """
+
+    def __init__(self, envs, mode='array', stdout=None, stderr=None):
+        if mode not in JSON_MODES:
+            msg = ('JSON mode \'%s\' is not one of %s' %
+                   (mode, ', '.join(JSON_MODES)))
+            raise AttributeError(msg)
+        super(JsonMultiplexer, self).__init__(envs, 'stream', stdout, stderr)
+        self.json_mode = mode
+        self.notices = self.stderr
+        self.records = 0
+
+    def error(self, env, error):
+        with self.lock:
+            utils.print_error(error, exit=False)
+
+    def _read(self, env, index, pipe, counts):
+        if index == 1:
+            return super(JsonMultiplexer, self)._read(env, index, pipe,
+                                                      counts)
+        import tempfile
+
+        self.invalid.discard(env)
+        stream = JsonStream()
+        # Keep what was read so the output can still be shown if it turns
+        # out not to be JSON
+        raw = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        try:
+            for chunk in iter(lambda: pipe.readline(READ_SIZE), b''):
+                counts[index] += len(chunk)
+                raw.write(chunk)
+                self.write_records(env, stream.feed(chunk))
+            self.write_records(env, stream.close())
+        except ValueError as e:
+            self.invalid.add(env)
+            with self.lock:
+                utils.print_error('%s: could not parse the output as JSON, '
+                                  'it follows on stderr: %s' % (env, e),
+                                  exit=False)
+            for chunk in iter(lambda: pipe.read(READ_SIZE), b''):
+                counts[index] += len(chunk)
+                raw.write(chunk)
+            raw.seek(0)
+            # Pass the output along to stderr as it was
+            super(JsonMultiplexer, self)._read(env, 1, raw, [0, 0])
+        raw.close()
+        pipe.close()
+
+    def write_records(self, env, records):
+        if not records:
+            return
+        lines = []
+        for record in records:
+            if not isinstance(record, dict):
+                record = {'Value': record}
+            record[JSON_ENV_KEY] = env
+            lines.append(json.dumps(record, sort_keys=True))
+        with self.lock:
+            for line in lines:
+                if self.json_mode == 'ndjson':
+                    self.stdout.write(line + '\n')
+                else:
+                    self.stdout.write(',\n' if self.records else '[\n')
+                    self.stdout.write(line)
+                self.records += 1
+            self.stdout.flush()
+
+    def close(self):
+        if self.json_mode == 'array':
+            with self.lock:
+                self.stdout.write('\n]\n' if self.records else '[]\n')
+                self.stdout.flush()
+
+
+class WatchMultiplexer(OutputMultiplexer):
+    """
+    Holds each environment's output like replay does, but only prints how
+    it differs from the output of the previous run, which is kept in
+    snapshots between runs. The first time an environment is run all of its
+    output is printed.
+    """
+
+    def __init__(self, envs, snapshots, stdout=None, stderr=None):
+        super(WatchMultiplexer, self).__init__(envs, 'replay', stdout, stderr)
+        self.snapshots = snapshots
+        self.changed = 0
+
+    def _replay(self, env):
+        import difflib
+
+        title, msg = self.headers.pop(env)
+        output = []
+        for spool in self.spools.pop(env, ()):
+            spool.seek(0)
+            output.append(spool.read().decode('utf-8', 'replace'))
+            spool.close()
+        error = self.errors.pop(env, None)
+        if error is not None:
+            output.append('%s\n' % error)
+        lines = ''.join(output).splitlines()
+        previous = self.snapshots.get(env)
+        self.snapshots[env] = lines
+        if previous == lines:
+            return
+        self.changed += 1
+        if previous is None:
+            if msg:
+                utils.print_notice(msg, title=title, file=self.stdout)
+            for line in lines:
+                print(line, file=self.stdout)
+        else:
+            utils.print_notice('%s changed at %s:' %
+                               (env, time.strftime('%H:%M:%S')),
+                               title='CHANGED', file=self.stdout)
+            diff = difflib.unified_diff(previous, lines, lineterm='', n=0)
+            for line in diff:
+                if line.startswith(('---', '+++')):
+                    continue
+                if line.startswith('+'):
+                    line = utils.gwrap(line)
+                elif line.startswith('-'):
+                    line = utils.rwrap(line)
+                print('[%s] %s' % (env, line), file=self.stdout)
+        self.stdout.flush()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+An interactive shell that keeps environments and their credentials resolved
+between commands
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import cmd
+import importlib
+import os
+import shlex
+import sys
+import textwrap
+from . import client
+from . import shell
+from . import timings
+from . import utils
+
+# The clients the shell can run, and the wrapper class of each
+CLIENTS = {
+    'ceilometer': ('multistack.clients.ceilometer', 'MultiCeilometer'),
+    'cinder': ('multistack.clients.cinder', 'MultiCinder'),
+    'glance': ('multistack.clients.glance', 'MultiGlance'),
+    'heat': ('multistack.clients.heat', 'MultiHeat'),
+    'keystone': ('multistack.clients.keystone', 'MultiKeystone'),
+    'neutron': ('multistack.clients.neutron', 'MultiNeutron'),
+    'nova': ('multistack.clients.nova', 'MultiNova'),
+    'openstack': ('multistack.clients.openstack', 'MultiOpenstack'),
+    'solum': ('multistack.clients.solum', 'MultiSolum'),
+    'swift': ('multistack.clients.swift', 'MultiSwift'),
+    'trove': ('multistack.clients.trove', 'MultiTrove'),
+}
+
+HISTORY_FILE = '~/.multistack_history'
+HISTORY_LENGTH = 1000
+
+
+class MultiStackRepl(cmd.Cmd):
+    """
+    Runs client commands against the environments chosen with use. Each
+    client's wrapper is only created once, and the run config of every
+    selection a client has run against is kept, so going back to a
+    selection doesn't resolve its credentials again. Credentials are shared
+    between the clients.
+    """
+
+    intro = ('MultiStack shell. Choose environments with use, then run '
+             'client commands such as "nova list". Type help for more.')
+
+    def __init__(self):
+        cmd.Cmd.__init__(self)
+        self.multiclient = client.MultiClient()
+        self.shells = {}
+        self.run_configs = {}
+        self.credential_cache = {}
+        self.selection = None
+        self.env = None
+        self.envs = []
+        self.readline = None
+        self.update_prompt()
+
+    def update_prompt(self):
+        if self.env:
+            self.prompt = 'multistack (%s)> ' % self.env
+        elif self.envs:
+            self.prompt = 'multistack (%d envs)> ' % len(self.envs)
+        else:
+            self.prompt = 'multistack> '
+
+    def preloop(self):
+        if self.readline:
+            # The loop was restarted after an interrupt
+            return
+        try:
+            import readline
+        except ImportError:
+            return
+        self.readline = readline
+        # Let options and patterns be completed as a whole
+        readline.set_completer_delims(' \t\n')
+        try:
+            readline.read_history_file(os.path.expanduser(HISTORY_FILE))
+        except (IOError, OSError):
+            pass
+        readline.set_history_length(HISTORY_LENGTH)
+
+    def postloop(self):
+        if self.readline:
+            try:
+                self.readline.write_history_file(
+                    os.path.expanduser(HISTORY_FILE))
+            except (IOError, OSError):
+                pass
+
+    def onecmd(self, line):
+        try:
+            return cmd.Cmd.onecmd(self, line)
+        except AttributeError as e:
+            utils.print_error(e, exit=False)
+        except SystemExit:
+            # Argument and configuration errors have been printed already
+            pass
+        except KeyboardInterrupt:
+            print()
+
+    def emptyline(self):
+        pass
+
+    def get_names(self):
+        # Keep EOF, which is CTRL-D, out of the help
+        return [name for name in cmd.Cmd.get_names(self) if name != 'do_EOF']
+
+    def get_shell(self, name):
+        """
+        Returns the wrapper shell of a client, creating it the first time
+        the client is used.
+        """
+        if name not in self.shells:
+            module_name, class_name = CLIENTS[name]
+            client_class = getattr(importlib.import_module(module_name),
+                                   class_name)
+            multishell = shell.MultiShell(client_class)
+            multishell.multiclient.credential_cache = self.credential_cache
+            multishell.check_environment_presets()
+            self.shells[name] = multishell
+        return self.shells[name]
+
+    def do_use(self, arg):
+        """
+        use ENV|GROUP|PATTERN, use [--match REGEX] [--tags EXPR]
+        Chooses the environments that client commands are run against.
+        """
+        parser = argparse.ArgumentParser(prog='use', add_help=False)
+        parser.add_argument('--match', metavar='REGEX')
+        parser.add_argument('--tags', metavar='EXPR')
+        parser.add_argument('env', nargs='?')
+        args = parser.parse_args(shlex.split(arg))
+        if args.match or args.tags:
+            envs = self.multiclient.select_envs(pattern=args.env,
+                                                regex=args.match,
+                                                tags=args.tags)
+            env = None
+        elif args.env:
+            envs = self.multiclient.get_envs(args.env)
+            env = args.env if self.multiclient.client_config.has_section(
+                args.env) else None
+        else:
+            parser.error('an environment, --match or --tags is required')
+        self.selection = arg
+        self.env = env
+        self.envs = envs
+        self.update_prompt()
+
+    def complete_use(self, text, line, begidx, endidx):
+        return [env for env in self.multiclient.client_config.sections()
+                if env.startswith(text)]
+
+    def do_envs(self, arg):
+        """
+        envs
+        Shows the environments that client commands are run against.
+        """
+        if not self.envs:
+            utils.print_notice('No environments have been chosen yet, '
+                               'choose some with use.')
+            return
+        for env in self.envs:
+            print(env)
+
+    def do_clients(self, arg):
+        """
+        clients
+        Shows the clients that commands can be run with.
+        """
+        for name in sorted(CLIENTS):
+            print(name)
+
+    def do_refresh(self, arg):
+        """
+        refresh
+        Forgets every resolved environment and credential and reloads the
+        configuration, such as after a password was changed.
+        """
+        self.multiclient = client.MultiClient()
+        self.shells = {}
+        self.run_configs = {}
+        self.credential_cache = {}
+        selection = self.selection
+        self.selection = self.env = None
+        self.envs = []
+        self.update_prompt()
+        if selection:
+            # The environments chosen may have changed with the configuration
+            self.do_use(selection)
+
+    def do_exit(self, arg):
+        """
+        exit
+        Leaves the shell.
+        """
+        return True
+
+    do_quit = do_exit
+
+    def do_EOF(self, arg):
+        print()
+        return True
+
+    def do_help(self, arg):
+        """
+        help [COMMAND|CLIENT]
+        Shows the shell's commands, or the options of a client.
+        """
+        if arg in CLIENTS:
+            self.get_shell(arg).build_parser(selecting=False,
+                                             prog=arg).print_help()
+            return
+        method = getattr(self, 'do_%s' % arg, None) if arg else None
+        if method is not None and method.__doc__:
+            print(textwrap.dedent(method.__doc__).strip())
+            return
+        cmd.Cmd.do_help(self, arg)
+        if not arg:
+            print('Clients (help CLIENT shows its options):')
+            print('  %s\n' % ' '.join(sorted(CLIENTS)))
+
+    def completenames(self, text, *ignored):
+        return sorted(cmd.Cmd.completenames(self, text, *ignored) +
+                      [name for name in CLIENTS if name.startswith(text)])
+
+    def completedefault(self, text, line, begidx, endidx):
+        words = line.split()
+        if not words or words[0] not in CLIENTS:
+            return []
+        multishell = self.get_shell(words[0])
+        if text.startswith('-'):
+            parser = multishell.build_parser(selecting=False)
+            return sorted(option for option in parser._option_string_actions
+                          if option.startswith(text))
+        commands = multishell.multiclient.read_only_commands
+        return sorted(set(command.split()[0] for command in commands
+                          if command.startswith(text)))
+
+    def default(self, line):
+        """
+        Runs a client command, with any of the wrapper's options, against
+        the chosen environments.
+        """
+        try:
+            words = shlex.split(line)
+        except ValueError as e:
+            utils.print_error(e, exit=False)
+            return
+        if words[0] not in CLIENTS:
+            utils.print_error('Unknown command \'%s\', type help to see what '
+                              'can be run' % words[0], exit=False)
+            return
+        if not self.envs:
+            utils.print_error('Choose the environments to run against with '
+                              'use first', exit=False)
+            return
+        self.run_command(words[0], words[1:])
+
+    def run_command(self, name, argv):
+        multishell = self.get_shell(name)
+        multiclient = multishell.multiclient
+        multishell.build_parser(selecting=False, prog=name)
+        multistack_args, client_args = multishell.parse_args(argv)
+        if multistack_args.batch:
+            commands = multishell.read_batch(multistack_args.batch,
+                                             client_args)
+        elif not client_args:
+            utils.print_error('No arguments were provided to pass along to '
+                              'the client.', exit=False)
+            return
+        key = (name, tuple(self.envs))
+        if key not in self.run_configs:
+            self.run_configs[key] = multiclient.get_run_config(self.envs)
+        multiclient.set_run_config(self.run_configs[key], self.env)
+        # Only time this command
+        multiclient.timings = timings.Timings()
+        if multistack_args.batch:
+            multiclient.run_batch(commands, multistack_args)
+        else:
+            multiclient.run_client(client_args, multistack_args)
+
+
+def main_multistack():
+    parser = argparse.ArgumentParser(
+        prog='multistack',
+        description='Runs the MultiStack tools that aren\'t tied to a '
+                    'single client.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    shell_parser = subparsers.add_parser(
+        'shell', help='start an interactive shell that keeps environments '
+                      'and credentials resolved between commands')
+    shell_parser.add_argument('env', nargs='?',
+                              help='environment, group or shell-style '
+                                   'pattern to start with')
+    args = parser.parse_args()
+    if args.command != 'shell':
+        parser.print_help()
+        sys.exit(1)
+    try:
+        repl = MultiStackRepl()
+    except AttributeError as e:
+        utils.print_error(e)
+    if args.env:
+        repl.onecmd('use %s' % args.env)
+    while True:
+        try:
+            repl.cmdloop()
+            break
+        except KeyboardInterrupt:
+            # Like other shells, CTRL-C throws away the line being typed
+            print('^C')
+            repl.intro = ''
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Caches the output of read-only client commands on disk for a short while
+
+Entries are kept in files named after a hash of what was run, and the
+least recently used ones are removed once the cache grows past its size
+limit. Like the token cache, the modules needed for this are only imported
+once the cache is actually used.
+"""
+import json
+import os
+import time
+
+# Megabytes the cache may take up before old entries are removed
+DEFAULT_SIZE = 64
+
+
+def cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.expanduser('~/.cache')
+    return os.path.join(cache_home, 'multistack', 'responses')
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def command_words(client_args):
+    """
+    Returns the arguments that aren't options, which start with the command.
+    """
+    return [arg for arg in client_args if not arg.startswith('-')]
+
+
+def is_read_only(client_args, commands):
+    """
+    Returns whether the client arguments run one of the commands, each of
+    which is one or more words such as 'list' or 'server list'.
+    """
+    words = command_words(client_args)
+    for command in commands:
+        command = command.split()
+        if command and words[:len(command)] == command:
+            return True
+    return False
+
+
+def cache_key(env, executable, client_args, env_overlay):
+    """
+    Returns the key an entry is cached under. The environment's variables
+    are part of it so that changing its configuration doesn't reuse output
+    from before the change.
+    """
+    import hashlib
+
+    overlay = sorted((name, _text(value))
+                     for name, value in env_overlay.items())
+    key = json.dumps([env, executable, client_args, overlay])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def lookup(key, ttl):
+    """
+    Returns the (returncode, stdout, stderr) of an entry that is younger
+    than ttl seconds, or None.
+    """
+    import base64
+
+    path = os.path.join(cache_dir(), key)
+    try:
+        with open(path) as entry_file:
+            entry = json.load(entry_file)
+        if entry['created'] + ttl <= time.time():
+            return None
+        # Mark the entry as recently used
+        os.utime(path, None)
+        return (entry['returncode'],
+                base64.b64decode(entry['stdout'].encode('ascii')),
+                base64.b64decode(entry['stderr'].encode('ascii')))
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def store(key, returncode, stdout, stderr, max_size=DEFAULT_SIZE):
+    """
+    Saves an entry and removes the least recently used entries while the
+    cache is larger than max_size megabytes. Failing to save is not an
+    error.
+    """
+    import base64
+    import tempfile
+
+    max_bytes = max_size * 1024 * 1024
+    # Don't let one entry push out everything else
+    if len(stdout) + len(stderr) > max_bytes // 4:
+        return
+    directory = cache_dir()
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.')
+        with os.fdopen(fd, 'w') as entry_file:
+            json.dump({'created': time.time(), 'returncode': returncode,
+                       'stdout': base64.b64encode(stdout).decode('ascii'),
+                       'stderr': base64.b64encode(stderr).decode('ascii')},
+                      entry_file)
+        os.rename(tmp_path, os.path.join(directory, key))
+        evict(directory, max_bytes)
+    except (IOError, OSError):
+        pass
+
+
+def evict(directory, max_bytes):
+    """
+    Removes the least recently used entries until the cache fits.
+    """
+    entries = []
+    total = 0
+    for name in os.listdir(directory):
+        if name.startswith('.'):
+            continue
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+        total += stat.st_size
+    entries.sort()
+    while total > max_bytes and entries:
+        _, size, name = entries.pop(0)
+        try:
+            os.unlink(os.path.join(directory, name))
+        except OSError:
+            pass
+        total -= size
+
+
+def clear():
+    """
+    Removes every entry from the cache.
+    """
+    directory = cache_dir()
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        try:
+            os.unlink(os.path.join(directory, name))
+        except OSError:
+            pass
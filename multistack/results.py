@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Keeps track of how the client did in each environment
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sys
+from . import utils
+
+
+class EnvResult(object):
+    """
+    The outcome of running the client against one environment.
+    """
+
+    def __init__(self, env, executable=None, label=None):
+        self.env = env
+        self.executable = executable
+        self.label = label or env
+        self.returncode = None
+        self.duration = 0.0
+        self.output_bytes = None
+        self.error = None
+        self.timed_out = False
+        self.skipped = False
+        self.attempts = 0
+        self.cached = False
+        self.invalid_output = False
+
+    @property
+    def failed(self):
+        return (self.error is not None or self.returncode != 0 or
+                self.invalid_output)
+
+    @property
+    def status(self):
+        if self.skipped:
+            return 'skipped'
+        if self.error is not None:
+            return 'spawn error'
+        if self.timed_out:
+            return 'timed out'
+        if self.invalid_output:
+            return 'invalid json'
+        if self.cached and self.returncode == 0:
+            return 'cached'
+        if self.returncode == 0:
+            return 'ok'
+        return 'exit %s' % self.returncode
+
+
+def parse_exit_policy(policy):
+    """
+    Checks an exit policy and returns it as (kind, threshold).
+
+    any:  fail if any environment failed.
+    all:  fail only if every environment failed.
+    N:    fail if at least N environments failed.
+    N%:   fail if at least N percent of the environments failed.
+    """
+    policy = (policy or 'any').strip().lower()
+    if policy in ('any', 'all'):
+        return policy, None
+    try:
+        if policy.endswith('%'):
+            threshold = float(policy[:-1])
+            kind = 'percent'
+        else:
+            threshold = int(policy)
+            kind = 'count'
+    except ValueError:
+        threshold = None
+    if threshold is None or threshold <= 0:
+        msg = ('Exit policy \'%s\' must be any, all, a positive number of '
+               'failures or a percentage of failures' % policy)
+        raise AttributeError(msg)
+    return kind, threshold
+
+
+def exit_status(results, policy='any'):
+    """
+    Returns the overall exit status for a run under the given exit policy.
+    The status is that of the first failed environment when the run is
+    considered a failure and 0 otherwise.
+    """
+    kind, threshold = parse_exit_policy(policy)
+    failures = [result for result in results if result.failed]
+    if not failures:
+        return 0
+    if kind == 'any':
+        failed = True
+    elif kind == 'all':
+        failed = len(failures) == len(results)
+    elif kind == 'count':
+        failed = len(failures) >= threshold
+    else:
+        failed = len(failures) * 100.0 / len(results) >= threshold
+    if not failed:
+        return 0
+    returncode = failures[0].returncode or 1
+    # Report clients killed by a signal the same way a shell does
+    if returncode < 0:
+        returncode = 128 - returncode
+    return returncode
+
+
+def print_summary(results, file=None):
+    """
+    Prints a table with one line per environment.
+    """
+    file = file or sys.stdout
+    failures = len([result for result in results if result.failed])
+    msg = '%d of %d runs succeeded' % (len(results) - failures,
+                                       len(results))
+    utils.print_notice(msg, title='SUMMARY', file=file)
+    width = max([len('ENVIRONMENT')] + [len(result.label)
+                                         for result in results])
+    row = '  %%-%ds  %%-12s  %%9s  %%12s' % width
+    print(row % ('ENVIRONMENT', 'STATUS', 'TIME', 'OUTPUT'), file=file)
+    for result in results:
+        if result.output_bytes is None:
+            output_bytes = '-'
+        else:
+            output_bytes = '%d bytes' % result.output_bytes
+        status = result.status
+        if result.failed:
+            status = utils.rwrap(status.ljust(12))
+        print(row % (result.label, status, '%.2fs' % result.duration,
+                     output_bytes), file=file)
+        if result.attempts > 1:
+            print('    after %d attempts' % result.attempts, file=file)
+        if result.error is not None:
+            print('    %s' % result.error, file=file)
@@ -21,16 +21,26 @@ from __future__ import print_function
 import argparse
 import getpass
 import os
+import shlex
 import sys
 from . import utils
 from . import config
 from . import credentials
+from . import executor
+from . import manifests
+from . import output
+
+# Environment variables that are read by multistack itself
+MULTISTACK_VARIABLES = [config.AGENT_SOCKET_ENV]
 
 
 class MultiShell(object):
 
     def __init__(self, multiclient):
-        self.multiclient = multiclient()
+        try:
+            self.multiclient = multiclient()
+        except AttributeError as e:
+            utils.print_error(e)
 
     def check_environment_presets(self):
         """
@@ -38,21 +48,59 @@ class MultiShell(object):
         """
         prefix_tuple = tuple([x.upper() for x in self.multiclient.prefix_list])
         presets = [x for x in os.environ.copy().keys() if x.startswith(
-            prefix_tuple)]
+            prefix_tuple) and x not in MULTISTACK_VARIABLES]
         if len(presets) > 0:
             utils.print_error("Found existing environment variables that may "
                               "cause conflicts:", title='Warning', exit=False)
             for preset in presets:
                 print("  - %s" % preset)
 
-    def run_client(self):
-        self.check_environment_presets()
-        valid_envs = sorted(self.multiclient.available_envs)
-        self.parser = argparse.ArgumentParser()
-        self.parser.add_argument('-l', '--list', action=utils._ListAction,
-                                 dest='listenvs',
-                                 client_config=self.multiclient.client_config,
-                                 help='list all configured environments')
+    def read_batch(self, path, client_args):
+        """
+        Reads one client command per line from a file, or stdin if the path
+        is -. Blank lines and lines starting with # are skipped. Any client
+        arguments given on the command line are put in front of every
+        command.
+        """
+        try:
+            if path == '-':
+                lines = sys.stdin.readlines()
+            else:
+                with open(path) as batch_file:
+                    lines = batch_file.readlines()
+        except (IOError, OSError) as e:
+            utils.print_error(e, title='Cannot read batch file')
+        commands = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                commands.append(client_args + shlex.split(line))
+            except ValueError as e:
+                utils.print_error('%s: %s' % (line, e),
+                                  title='Invalid batch command')
+        if not commands:
+            utils.print_error('No commands were found in %s' % path,
+                              title='Missing client arguments')
+        return commands
+
+    def build_parser(self, selecting=True, prog=None):
+        """
+        Returns the parser for the wrapper's arguments. Without selecting,
+        the arguments that choose the environments are left out, for when
+        they have already been chosen. Everything after the environment is
+        left for the client, and abbreviated options aren't accepted, so the
+        client's own options are never taken for the wrapper's.
+        """
+        try:
+            self.parser = argparse.ArgumentParser(prog=prog,
+                                                  allow_abbrev=False)
+        except TypeError:
+            # Python 2's argparse always accepts abbreviations
+            self.parser = argparse.ArgumentParser(prog=prog)
+        if selecting:
+            utils.add_list_arguments(self.parser)
         self.parser.add_argument('-x', '--executable',
                                  help='command to run instead of '
                                       '%s' %
@@ -62,17 +110,162 @@ class MultiShell(object):
         self.parser.add_argument('-r', '--dryrun', action='store_true',
                                  help='Dry run. Output what would be ran but '
                                  'take no action.')
-        self.parser.add_argument('env',
-                                 help='environment to run the client against.',
-                                 choices=valid_envs)
-        multistack_args, client_args = self.parser.parse_known_args()
-        if not client_args:
+        self.parser.add_argument('--parallel', type=int, metavar='N',
+                                 help='number of environments in a group to '
+                                      'run the client against at once')
+        self.parser.add_argument('--output',
+                                 choices=output.OUTPUT_MODES,
+                                 help='how to show the output of each '
+                                      'environment: prefix every line with '
+                                      'its environment (stream) or print '
+                                      'each environment as a block in order '
+                                      '(replay). Defaults to stream when '
+                                      'running in parallel.')
+        self.parser.add_argument('--merge-json', action='store_const',
+                                 const='array',
+                                 help='parse the JSON output of each '
+                                      'environment (e.g. from -f json) and '
+                                      'merge it into one list, tagging each '
+                                      'record with its environment')
+        self.parser.add_argument('--ndjson', action='store_const',
+                                 const='ndjson', dest='merge_json',
+                                 help='like --merge-json, but write one '
+                                      'record per line')
+        self.parser.add_argument('--timeout', type=float, metavar='SECONDS',
+                                 help='stop the client in an environment '
+                                      'after SECONDS')
+        self.parser.add_argument('--deadline', type=float, metavar='SECONDS',
+                                 help='stop every client still running after '
+                                      'SECONDS and skip the rest')
+        self.parser.add_argument('--retries', type=int, metavar='N',
+                                 help='run a failed client up to N more times')
+        self.parser.add_argument('--retry-on', metavar='CODES',
+                                 help='comma separated exit codes, or '
+                                      '"timeout", to retry on (default: any '
+                                      'failure)')
+        self.parser.add_argument('--backoff', type=float, metavar='SECONDS',
+                                 help='wait before the first retry, doubled '
+                                      'for each retry after it (default: 1)')
+        self.parser.add_argument('--pool-concurrency', type=int, metavar='N',
+                                 help='run at most N clients at once against '
+                                      'each endpoint or MULTISTACK_POOL')
+        self.parser.add_argument('--pool-rate', type=float, metavar='RATE',
+                                 help='start at most RATE clients per second '
+                                      'against each endpoint or '
+                                      'MULTISTACK_POOL')
+        self.parser.add_argument('--timings', action='store_true',
+                                 help='show how long each phase of the run '
+                                      'took')
+        self.parser.add_argument('--trace', metavar='FILE',
+                                 help='write the timings of every '
+                                      'environment to FILE as a Chrome trace')
+        self.parser.add_argument('--metrics-file', metavar='FILE',
+                                 help='write the outcome of each environment '
+                                      'to FILE for the Prometheus textfile '
+                                      'collector')
+        self.parser.add_argument('--statsd', metavar='HOST[:PORT]',
+                                 help='send the outcome of each environment '
+                                      'to StatsD')
+        self.parser.add_argument('--exit-policy', default='any',
+                                 metavar='POLICY',
+                                 help='when a group run counts as failed: '
+                                      'any (default), all, a number of '
+                                      'failed environments (e.g. 3) or a '
+                                      'percentage of them (e.g. 25%%)')
+        self.parser.add_argument('--clean-env', action='store_true',
+                                 help='only pass the client basic variables '
+                                      'such as PATH and HOME from the current '
+                                      'environment')
+        self.parser.add_argument('--cache-ttl', type=float, metavar='SECONDS',
+                                 help='reuse the output of read-only '
+                                      'commands for up to SECONDS')
+        self.parser.add_argument('--no-cache', action='store_true',
+                                 help='don\'t use or update the response '
+                                      'cache')
+        self.parser.add_argument('--refresh', action='store_true',
+                                 help='run read-only commands even if their '
+                                      'output is cached, and cache the new '
+                                      'output')
+        self.parser.add_argument('--watch', type=float,
+                                 metavar='SECONDS',
+                                 help='run the client again every SECONDS '
+                                      'until interrupted, printing only what '
+                                      'changed in each environment\'s output')
+        self.parser.add_argument('--token-cache', action='store_true',
+                                 help='authenticate once per environment and '
+                                      'pass a cached token to the client')
+        self.parser.add_argument('--batch', metavar='FILE',
+                                 help='run each line of FILE (or stdin if '
+                                      'FILE is -) as a separate client '
+                                      'command')
+        if selecting:
+            self.add_selection_arguments()
+        self.parser.add_argument('client_args', nargs=argparse.REMAINDER,
+                                 metavar='...',
+                                 help='arguments to pass to the client')
+        return self.parser
+
+    def add_selection_arguments(self):
+        self.parser.add_argument('--match', metavar='REGEX',
+                                 help='run against every environment whose '
+                                      'name matches REGEX')
+        self.parser.add_argument('--tags', metavar='EXPR',
+                                 help='run against every environment whose '
+                                      'MULTISTACK_TAGS match EXPR, e.g. '
+                                      '"region:us and not tier:dev"')
+        self.parser.add_argument('env', nargs='?',
+                                 help='environment, group or shell-style '
+                                      'pattern to run the client against. '
+                                      'Leave it out when using --match or '
+                                      '--tags.')
+
+    def parse_args(self, args=None):
+        """
+        Returns the wrapper's arguments and the client's arguments. Options
+        the wrapper doesn't know that come before the environment are passed
+        to the client too.
+        """
+        multistack_args, unknown_args = self.parser.parse_known_args(args)
+        client_args = multistack_args.client_args
+        selecting = (getattr(multistack_args, 'match', None) or
+                     getattr(multistack_args, 'tags', None))
+        if selecting and multistack_args.env is not None:
+            # Without an environment to take, the first client argument was
+            # picked up as one
+            client_args = [multistack_args.env] + client_args
+            multistack_args.env = None
+        return multistack_args, unknown_args + client_args
+
+    def run_client(self):
+        self.build_parser()
+        multistack_args, client_args = self.parse_args()
+        # Only a --list before the environment is the wrapper's, after it
+        # the option belongs to the client
+        if multistack_args.listenvs:
+            utils.list_and_exit(self.multiclient.client_config,
+                                multistack_args)
+        self.check_environment_presets()
+        selecting = multistack_args.match or multistack_args.tags
+        if not selecting and multistack_args.env is None:
+            error = 'An environment, --match or --tags is required.'
+            utils.print_error(error, title='Missing environment')
+        if multistack_args.batch:
+            commands = self.read_batch(multistack_args.batch, client_args)
+        elif not client_args:
             error = 'No arguments were provided to pass along to the client.'
             utils.print_error(error, title='Missing client arguments')
         try:
-            self.multiclient.client_env = multistack_args.env
-            returncode = self.multiclient.run_client(client_args,
-                                                     multistack_args)
+            if selecting:
+                self.multiclient.select(regex=multistack_args.match,
+                                        tags=multistack_args.tags)
+            else:
+                self.multiclient.client_env = multistack_args.env
+            if multistack_args.batch:
+                returncode = self.multiclient.run_batch(commands,
+                                                        multistack_args)
+            else:
+                returncode = self.multiclient.run_client(client_args,
+                                                         multistack_args)
             sys.exit(returncode)
         except AttributeError as e:
             utils.print_error(e)
@@ -81,7 +274,10 @@ class MultiShell(object):
 class MultiKeyringShell(object):
 
     def __init__(self):
-        self.client_config = config.load_multistack_config()
+        try:
+            self.client_config = config.load_multistack_config()
+        except AttributeError as e:
+            utils.print_error(e)
 
     def get_password(self, parameter, env_list):
         utils.print_error(
@@ -191,12 +387,125 @@ should check your keyring configuration.
 should check your keyring configuration.
 """, title='Complete')
 
+    def read_passphrase(self, path, confirm=False):
+        """
+        Returns the passphrase for an export, from the first line of a file
+        or typed in at a prompt.
+        """
+        if path:
+            try:
+                with open(path) as passphrase_file:
+                    passphrase = passphrase_file.readline().rstrip('\r\n')
+            except (IOError, OSError) as e:
+                utils.print_error(e, title='Cannot read passphrase file')
+        else:
+            try:
+                passphrase = getpass.getpass('Passphrase: ')
+                if confirm and passphrase != getpass.getpass(
+                        'Passphrase again: '):
+                    utils.print_error('The passphrases didn\'t match.',
+                                      title='Canceled')
+            except (EOFError, KeyboardInterrupt):
+                print()
+                passphrase = None
+        if not passphrase:
+            utils.print_error('Your keyring was not read or altered.',
+                              title='Canceled')
+        return passphrase
+
+    def apply_changes(self, changes, workers):
+        """
+        Makes every (env, parameter, value) change to the keyring, setting
+        the credential or deleting it if the value is None, without asking
+        first. Exits with an error if any of them failed.
+        """
+        def apply_change(change):
+            env, parameter, value = change
+            if value is None:
+                return credentials.password_delete(env, parameter)
+            return credentials.password_set(env, parameter, value)
+
+        done = executor.run_jobs(apply_change, changes,
+                                 credentials.write_workers(workers))
+        for (env, parameter, value), ok in zip(changes, done):
+            msg = '%s->%s%s' % (env, parameter,
+                                ' (deleted)' if value is None else '')
+            if ok:
+                utils.print_notice(msg, title='Success')
+            else:
+                utils.print_error(msg, title='Failed', exit=False)
+        msg = '%d of %d keyring changes succeeded.' % (
+            len([ok for ok in done if ok]), len(changes))
+        if not all(done):
+            utils.print_error(msg, title='Complete')
+        utils.print_notice(msg, title='Complete')
+
+    def apply_manifest(self, path, manifest_format, env_list, workers):
+        changes = manifests.resolve_manifest(
+            manifests.read_manifest(path, manifest_format), env_list)
+        if not changes:
+            utils.print_error('No keyring changes were found in %s' % path,
+                              title='Canceled')
+        self.apply_changes(changes, workers)
+
+    def export_credentials(self, path, env_list, passphrase_file, workers):
+        keys = manifests.keyring_references(self.client_config, env_list)
+        if not keys:
+            utils.print_error('The configuration doesn\'t use any '
+                              'credentials from the keyring.',
+                              title='Canceled')
+        passphrase = self.read_passphrase(passphrase_file, confirm=True)
+        passwords = executor.run_jobs(
+            lambda key: credentials.password_get(*key), keys, workers)
+        changes = []
+        for (env, parameter), password in zip(keys, passwords):
+            if password:
+                changes.append((env, parameter, password.decode('utf-8')))
+            else:
+                utils.print_error('%s->%s is not in the keyring and was '
+                                  'left out' % (env, parameter),
+                                  title='Missing', exit=False)
+        manifests.write_private(path, manifests.encrypt_export(changes,
+                                                               passphrase))
+        utils.print_notice('%d credentials were exported to %s' %
+                           (len(changes), path), title='Complete')
+
+    def import_credentials(self, path, env_list, passphrase_file, workers):
+        try:
+            with open(path) as export_file:
+                data = export_file.read()
+        except (IOError, OSError) as e:
+            utils.print_error(e, title='Cannot read export')
+        passphrase = self.read_passphrase(passphrase_file)
+        changes = manifests.resolve_manifest(
+            manifests.decrypt_export(data, passphrase), env_list)
+        if not changes:
+            utils.print_error('No credentials were found in %s' % path,
+                              title='Canceled')
+        self.apply_changes(changes, workers)
+
+    def run_bulk(self, args):
+        """
+        Runs --apply, --export or --import, which work on many credentials
+        at once.
+        """
+        try:
+            if args.apply:
+                self.apply_manifest(args.apply, args.manifest_format,
+                                    args.env, args.workers)
+            elif args.export:
+                self.export_credentials(args.export, args.env,
+                                        args.passphrase_file, args.workers)
+            else:
+                self.import_credentials(args.import_file, args.env,
+                                        args.passphrase_file, args.workers)
+        except (AttributeError, ImportError) as e:
+            utils.print_error(e)
+
     def run_keyring(self):
+        utils.list_if_asked(self.client_config)
         self.parser = argparse.ArgumentParser()
-        self.parser.add_argument('-l', '--list', action=utils._ListAction,
-                                 dest='listenvs',
-                                 client_config=self.client_config,
-                                 help='list all configured environments')
+        utils.add_list_arguments(self.parser)
         group = self.parser.add_mutually_exclusive_group(required=True)
         group.add_argument('-g', '--get', action='store_true',
                            dest='get_password',
@@ -207,12 +516,48 @@ should check your keyring configuration.
         group.add_argument('-d', '--delete', action='store_true',
                            dest='delete_password',
                            help='deletes credentials in keychain storage')
-        self.parser.add_argument('env',
-                                 help='environment to set parameter in',
-                                 nargs='+')
-        self.parser.add_argument('parameter',
-                                 help='parameter to set')
+        group.add_argument('--apply', metavar='MANIFEST',
+                           help='sets and deletes the credentials listed in '
+                                'MANIFEST (or stdin if it is -) without '
+                                'asking')
+        group.add_argument('--export', metavar='FILE',
+                           help='writes every credential the configuration '
+                                'keeps in the keyring to FILE, encrypted '
+                                'with a passphrase')
+        group.add_argument('--import', metavar='FILE', dest='import_file',
+                           help='stores the credentials of an export made '
+                                'with --export')
+        self.parser.add_argument('--manifest-format',
+                                 choices=manifests.MANIFEST_FORMATS,
+                                 help='format of the manifest (default: from '
+                                      'its extension, or json)')
+        self.parser.add_argument('--passphrase-file', metavar='FILE',
+                                 help='read the passphrase of an export from '
+                                      'the first line of FILE instead of '
+                                      'asking for it')
+        self.parser.add_argument('--workers', type=int, default=8,
+                                 metavar='N',
+                                 help='keyring reads and writes made at once '
+                                      'by --apply, --export and --import, '
+                                      'if the keyring backend allows it '
+                                      '(default: %(default)s)')
+        self.parser.add_argument('env', nargs='*',
+                                 help='environments to use, followed by the '
+                                      'parameter with --get, --set and '
+                                      '--delete. --apply, --export and '
+                                      '--import use every environment '
+                                      'unless some are given.')
+        self.parser.add_argument('parameter', nargs='?',
+                                 help='parameter to get, set or delete')
         args = self.parser.parse_args()
+        if args.apply or args.export or args.import_file:
+            return self.run_bulk(args)
+        # The environments take every argument, so the parameter is the last
+        if args.parameter is None:
+            if len(args.env) < 2:
+                self.parser.error('an environment and a parameter are '
+                                  'required')
+            args.parameter = args.env.pop()
         if args.get_password:
             self.get_password(args.parameter, sorted(args.env))
         if args.set_password:
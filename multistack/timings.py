@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Records how long each phase of a run takes
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from . import utils
+
+# The phases in the order they happen in, for the breakdown
+PHASES = ['config', 'keyring', 'creds', 'executable', 'token', 'backoff',
+          'spawn', 'wait']
+
+# Row of the trace for spans that don't belong to an environment
+MAIN_ROW = 'multistack'
+
+
+class Timings(object):
+    """
+    Spans of time spent in each phase, each optionally tied to an
+    environment. Recording a span is cheap enough to always be done, and the
+    spans are only looked at when --timings or --trace is given.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, phase, env, start, end):
+        with self.lock:
+            self.spans.append((phase, env, threading.current_thread().ident,
+                               start, end))
+
+    @contextlib.contextmanager
+    def span(self, phase, env=None):
+        """
+        Records the time spent in the body of a with statement.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(phase, env, start, time.time())
+
+    def totals(self, phase):
+        """
+        Returns the seconds spent in a phase, keyed by environment.
+        """
+        totals = {}
+        for span_phase, env, _, start, end in self.spans:
+            if span_phase == phase:
+                totals[env] = totals.get(env, 0.0) + end - start
+        return totals
+
+    def self_times(self):
+        """
+        Returns each span with the time spent in it, less the time spent in
+        spans nested inside it on the same thread, so that phases that
+        contain others aren't counted twice.
+        """
+        by_thread = {}
+        for span in self.spans:
+            by_thread.setdefault(span[2], []).append(span)
+        spans = []
+        for thread_spans in by_thread.values():
+            # Outer spans first when two start at the same time
+            thread_spans.sort(key=lambda span: (span[3], -span[4]))
+            stack = []
+            for span in thread_spans:
+                while stack and stack[-1][0][4] <= span[3]:
+                    spans.append(stack.pop())
+                if stack:
+                    stack[-1][1] -= span[4] - span[3]
+                stack.append([span, span[4] - span[3]])
+            spans.extend(stack)
+        return [(span, max(self_time, 0.0)) for span, self_time in spans]
+
+    def breakdown(self):
+        """
+        Returns the number of spans, the time spent and the longest span of
+        each phase, and the time from the first span to the last one.
+        """
+        phases = {}
+        for span, self_time in self.self_times():
+            count, total, longest = phases.get(span[0], (0, 0.0, 0.0))
+            phases[span[0]] = (count + 1, total + self_time,
+                               max(longest, self_time))
+        if not self.spans:
+            return phases, 0.0
+        elapsed = (max(span[4] for span in self.spans) -
+                   min(span[3] for span in self.spans))
+        return phases, elapsed
+
+    def print_breakdown(self, file=None):
+        """
+        Prints the time spent in each phase. Spans that run at the same time
+        in different environments are added up, so the totals can be more
+        than the time the run took.
+        """
+        file = file or sys.stdout
+        phases, elapsed = self.breakdown()
+        utils.print_notice('%.3fs from start to finish' % elapsed,
+                           title='TIMINGS', file=file)
+        row = '  %-10s  %6s  %10s  %10s'
+        print(row % ('PHASE', 'COUNT', 'TOTAL', 'LONGEST'), file=file)
+        names = [phase for phase in PHASES if phase in phases]
+        names += sorted(phase for phase in phases if phase not in PHASES)
+        for phase in names:
+            count, total, longest = phases[phase]
+            print(row % (phase, count, '%.2fms' % (total * 1000),
+                         '%.2fms' % (longest * 1000)), file=file)
+
+    def trace(self):
+        """
+        Returns the spans in the Chrome trace event format, with one row per
+        environment, which chrome://tracing and Perfetto can show as a
+        timeline.
+        """
+        if not self.spans:
+            return {'traceEvents': []}
+        origin = min(span[3] for span in self.spans)
+        pid = os.getpid()
+        rows = {MAIN_ROW: 0}
+        events = []
+        for phase, env, _, start, end in sorted(self.spans,
+                                                key=lambda span: span[3]):
+            row = env or MAIN_ROW
+            if row not in rows:
+                rows[row] = len(rows)
+            events.append({'name': phase, 'cat': 'multistack', 'ph': 'X',
+                           'pid': pid, 'tid': rows[row],
+                           'ts': int((start - origin) * 1000000),
+                           'dur': int((end - start) * 1000000),
+                           'args': {'env': env}})
+        for row, tid in rows.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                           'tid': tid, 'args': {'name': row}})
+            events.append({'name': 'thread_sort_index', 'ph': 'M',
+                           'pid': pid, 'tid': tid,
+                           'args': {'sort_index': tid}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_trace(self, path):
+        with open(path, 'w') as trace_file:
+            json.dump(self.trace(), trace_file)
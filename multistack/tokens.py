@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+"""
+Gets Keystone tokens on behalf of the clients and caches them on disk
+
+The modules needed to talk to Keystone are only imported once a token is
+actually needed so that the wrappers start quickly without this feature.
+"""
+import calendar
+import json
+import os
+import time
+
+# Don't hand out tokens that are about to expire
+EXPIRY_MARGIN = 60
+AUTH_TIMEOUT = 30
+
+
+class TokenError(Exception):
+    pass
+
+
+def _value(env_config, *names):
+    for name in names:
+        value = env_config.get(name)
+        if value:
+            if isinstance(value, bytes):
+                value = value.decode('utf-8')
+            return value
+    return None
+
+
+def _domain(env_config, prefix):
+    domain_id = _value(env_config, prefix + '_ID')
+    if domain_id:
+        return {'id': domain_id}
+    return {'name': _value(env_config, prefix + '_NAME') or 'Default'}
+
+
+def parse_expiry(expires):
+    """
+    Turns a Keystone expiry timestamp into seconds since the epoch. The
+    timestamp is in UTC unless it ends in an offset such as +02:00.
+    """
+    offset = 0
+    if expires.endswith('Z'):
+        expires = expires[:-1]
+    elif len(expires) > 6 and expires[-6] in '+-' and expires[-3] == ':':
+        sign = -1 if expires[-6] == '-' else 1
+        offset = sign * (int(expires[-5:-3]) * 3600 +
+                         int(expires[-2:]) * 60)
+        expires = expires[:-6]
+    expires = expires.split('.')[0]
+    return (calendar.timegm(time.strptime(expires, '%Y-%m-%dT%H:%M:%S')) -
+            offset)
+
+
+def auth_request(env_config):
+    """
+    Builds the Keystone password authentication request for an environment.
+    Returns the URL and the body to post to it.
+    """
+    auth_url = _value(env_config, 'OS_AUTH_URL')
+    username = _value(env_config, 'OS_USERNAME')
+    password = _value(env_config, 'OS_PASSWORD')
+    if not auth_url or not username or not password:
+        raise TokenError('OS_AUTH_URL, OS_USERNAME and OS_PASSWORD are '
+                         'needed to get a token')
+    auth_url = auth_url.rstrip('/')
+    version = _value(env_config, 'OS_IDENTITY_API_VERSION') or ''
+    project_id = _value(env_config, 'OS_PROJECT_ID', 'OS_TENANT_ID')
+    project_name = _value(env_config, 'OS_PROJECT_NAME', 'OS_TENANT_NAME')
+
+    if version.startswith('3') or auth_url.endswith('/v3'):
+        if not auth_url.endswith('/v3'):
+            auth_url += '/v3'
+        user = {'name': username, 'password': password,
+                'domain': _domain(env_config, 'OS_USER_DOMAIN')}
+        body = {'auth': {'identity': {'methods': ['password'],
+                                      'password': {'user': user}}}}
+        if project_id:
+            body['auth']['scope'] = {'project': {'id': project_id}}
+        elif project_name:
+            body['auth']['scope'] = {'project': {
+                'name': project_name,
+                'domain': _domain(env_config, 'OS_PROJECT_DOMAIN')}}
+        return auth_url + '/auth/tokens', body
+
+    body = {'auth': {'passwordCredentials': {'username': username,
+                                             'password': password}}}
+    if project_id:
+        body['auth']['tenantId'] = project_id
+    elif project_name:
+        body['auth']['tenantName'] = project_name
+    return auth_url + '/tokens', body
+
+
+def parse_catalog(data):
+    """
+    Returns the service catalog of a v2.0 or v3 token response as a list of
+    endpoints, each with a type, region, interface and url.
+    """
+    endpoints = []
+    if 'token' in data:
+        for service in data['token'].get('catalog') or []:
+            for endpoint in service.get('endpoints') or []:
+                endpoints.append({
+                    'type': service.get('type'),
+                    'region': (endpoint.get('region_id') or
+                               endpoint.get('region')),
+                    'interface': endpoint.get('interface'),
+                    'url': endpoint.get('url')})
+        return endpoints
+    for service in data['access'].get('serviceCatalog') or []:
+        for endpoint in service.get('endpoints') or []:
+            for interface in ('public', 'internal', 'admin'):
+                if endpoint.get(interface + 'URL'):
+                    endpoints.append({
+                        'type': service.get('type'),
+                        'region': endpoint.get('region'),
+                        'interface': interface,
+                        'url': endpoint[interface + 'URL']})
+    return endpoints
+
+
+def endpoint_url(env_config, catalog, service_types):
+    """
+    Returns the URL of a service from a catalog, in the region and with the
+    interface the environment asks for, or None if it has no such endpoint.
+    The service's catalog types are tried in the order given.
+    """
+    region = _value(env_config, 'OS_REGION_NAME')
+    interface = _value(env_config, 'OS_INTERFACE', 'OS_ENDPOINT_TYPE') or \
+        'public'
+    if interface.endswith('URL'):
+        interface = interface[:-3]
+    for service_type in service_types:
+        for endpoint in catalog:
+            if endpoint['type'] != service_type or \
+                    endpoint['interface'] != interface:
+                continue
+            if region and endpoint['region'] != region:
+                continue
+            return endpoint['url']
+    return None
+
+
+def authenticate(env_config):
+    """
+    Authenticates against Keystone and returns the token, the time it
+    expires at and the service catalog.
+    """
+    try:
+        from urllib2 import Request, urlopen
+    except:
+        from urllib.request import Request, urlopen
+
+    url, body = auth_request(env_config)
+    request = Request(url, json.dumps(body).encode('utf-8'),
+                      {'Content-Type': 'application/json',
+                       'Accept': 'application/json'})
+    try:
+        response = urlopen(request, timeout=AUTH_TIMEOUT)
+        data = json.loads(response.read().decode('utf-8'))
+        if url.endswith('/auth/tokens'):
+            token = response.headers.get('X-Subject-Token')
+            expires = data['token']['expires_at']
+        else:
+            token = data['access']['token']['id']
+            expires = data['access']['token']['expires']
+        expires = parse_expiry(expires)
+        catalog = parse_catalog(data)
+    except Exception as e:
+        raise TokenError('Could not get a token from %s: %s' % (url, e))
+    return token, expires, catalog
+
+
+def cache_path(env_config):
+    """
+    Returns where the token for a set of credentials is cached. The password
+    is part of the key so that changing it doesn't reuse an old token.
+    """
+    import hashlib
+
+    url, body = auth_request(env_config)
+    key = json.dumps([url, body], sort_keys=True).encode('utf-8')
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.expanduser('~/.cache')
+    return os.path.join(cache_home, 'multistack', 'tokens',
+                        hashlib.sha256(key).hexdigest())
+
+
+def get_token(env_config):
+    """
+    Returns a valid token for the environment and its service catalog,
+    reusing a cached one when it hasn't expired yet.
+    """
+    import tempfile
+
+    path = cache_path(env_config)
+    try:
+        with open(path) as cache_file:
+            cached = json.load(cache_file)
+        if cached['expires'] - EXPIRY_MARGIN > time.time():
+            return cached['token'], cached['catalog']
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    token, expires, catalog = authenticate(env_config)
+    try:
+        cache_dir = os.path.dirname(path)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'w') as cache_file:
+            json.dump({'token': token, 'expires': expires,
+                       'catalog': catalog}, cache_file)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
+    return token, catalog
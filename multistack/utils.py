@@ -20,27 +20,116 @@ from __future__ import print_function
 import sys
 import argparse
 
+LIST_FORMATS = ['text', 'json']
+# Options whose values --list hides unless --show-secrets is given
+# Endings of the names of options that hold secrets, such as OS_PASSWORD,
+# OS_TOKEN or RAX_API_KEY
+SECRET_SUFFIXES = ('PASSWORD', 'SECRET', '_TOKEN', 'APIKEY', 'API_KEY')
+SECRET_MASK = '********'
 
-class _ListAction(argparse._HelpAction):
-    """ListAction used for the -l and --list arguments."""
-    SUPPRESS = '==SUPPRESS=='
 
-    def __init__(self, option_strings, dest=SUPPRESS, default=SUPPRESS,
-                 client_config=None, help=None):
-        super(argparse._HelpAction, self).__init__(
-            option_strings=option_strings, dest=dest, default=default, nargs=0,
-            help=help)
-        self.environments = {}
-        for environment in client_config.sections():
-            self.environments[environment] = client_config.items(environment)
+def add_list_arguments(parser):
+    """
+    Adds the arguments for listing the configured environments.
+    """
+    parser.add_argument('-l', '--list', action='store_true', dest='listenvs',
+                        help='list the configured environments and exit')
+    parser.add_argument('--list-match', metavar='PATTERN',
+                        help='only list environments whose names match the '
+                             'shell-style PATTERN')
+    parser.add_argument('--list-group', metavar='GROUP',
+                        help='only list the members of GROUP')
+    parser.add_argument('--list-tags', metavar='EXPR',
+                        help='only list environments whose MULTISTACK_TAGS '
+                             'match EXPR')
+    parser.add_argument('--list-format', choices=LIST_FORMATS,
+                        default='text',
+                        help='how to list the environments (default: '
+                             '%(default)s)')
+    parser.add_argument('--show-secrets', action='store_true',
+                        help='show passwords and other secrets when listing')
+
+
+def list_if_asked(client_config, args=None):
+    """
+    Lists the configured environments and exits if --list was given. This is
+    checked before the rest of the arguments are parsed so that arguments
+    which are otherwise required can be left out.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    add_list_arguments(parser)
+    list_args, _ = parser.parse_known_args(args)
+    if list_args.listenvs:
+        list_and_exit(client_config, list_args)
+
+
+def list_and_exit(client_config, list_args):
+    """
+    Lists the configured environments as asked by the list arguments and
+    exits.
+    """
+    try:
+        list_environments(client_config, list_args)
+    except AttributeError as e:
+        print_error(e)
+    sys.exit(0)
 
-    def __call__(self, parser, *args, **kwargs):
-        for env, config in self.environments.items():
-            envheader = '-- %s ' % gwrap(env)
-            print(envheader.ljust(86, '-'))
-            for param, value in sorted(config):
-                print('  %s: %s' % (param.upper().ljust(21), value))
-        parser.exit()
+
+def is_secret(param):
+    return param.upper().endswith(SECRET_SUFFIXES)
+
+
+def list_entries(client_config, list_args):
+    """
+    Returns the sections to list as dictionaries holding their name, their
+    options and, for groups, their expanded members.
+    """
+    names = client_config.names
+    if list_args.list_match:
+        names = client_config.glob(list_args.list_match)
+    if list_args.list_group:
+        if list_args.list_group not in client_config.groups:
+            msg = ('\'%s\' is not a group in the multistack configuration '
+                   'file' % list_args.list_group)
+            raise AttributeError(msg)
+        members = set(client_config.expand_group(list_args.list_group))
+        names = [name for name in names if name in members]
+    if list_args.list_tags:
+        tagged = set(client_config.select_tags(list_args.list_tags))
+        names = [name for name in names if name in tagged]
+    for name in names:
+        options = {}
+        for param, value in client_config.items(name):
+            if not list_args.show_secrets and is_secret(param) and \
+                    not value.startswith('USE_KEYRING'):
+                value = SECRET_MASK
+            options[param.upper()] = value
+        entry = {'name': name, 'options': options}
+        if name in client_config.groups:
+            entry['members'] = client_config.expand_group(name)
+        yield entry
+
+
+def list_environments(client_config, list_args, file=None):
+    """
+    Prints the sections of the configuration, sorted by name, as text or as
+    a JSON list.
+    """
+    file = file or sys.stdout
+    entries = list_entries(client_config, list_args)
+    if list_args.list_format == 'json':
+        import json
+        json.dump(list(entries), file, indent=2, sort_keys=True)
+        file.write('\n')
+        return
+    for entry in entries:
+        envheader = '-- %s ' % gwrap(entry['name'])
+        print(envheader.ljust(86, '-'), file=file)
+        for param, value in sorted(entry['options'].items()):
+            print('  %s: %s' % (param.ljust(21), value), file=file)
+        if 'members' in entry:
+            print('  %s: %s' % ('EXPANDED MEMBERS'.ljust(21),
+                                ', '.join(entry['members'])), file=file)
 
 
 def gwrap(some_string):
@@ -65,7 +154,7 @@ def print_error(error, title=None, exit=True):
         sys.exit(1)
 
 
-def print_notice(msg, title=None):
+def print_notice(msg, title=None, file=None):
     if not title:
         title = "Notice"
-    print("[%s] %s" % (gwrap(title), msg))
+    print("[%s] %s" % (gwrap(title), msg), file=file or sys.stdout)
@@ -32,6 +32,9 @@ setuptools.setup(
     long_description=read_file("README.md"),
     license="Apache License, Version 2.0",
     install_requires=['keyring'],
+    extras_require={'python': ['keystoneauth1'],
+                    'yaml': ['PyYAML'],
+                    'export': ['cryptography']},
     url='https://github.com/testeddoughnut/multistack',
     download_url = 'https://github.com/testeddoughnut/multistack/releases/latest',
     classifiers=[
@@ -47,7 +50,9 @@ setuptools.setup(
     packages=setuptools.find_packages(exclude=['tests', 'tests.*', 'test_*']),
     entry_points={
         'console_scripts': [
+            'multistack = multistack.repl:main_multistack',
             'multistack-keyring = multistack.shell:main_keyring',
+            'multistack-agent = multistack.agent:main_agent',
             'multiceilometer = multistack.clients.ceilometer:main_client',
             'multicinder = multistack.clients.cinder:main_client',
             'multiglance = multistack.clients.glance:main_client',
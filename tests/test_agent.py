@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from multistack import agent
+from multistack import credentials
+
+
+class AgentServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.chmod(self.directory, 0o700)
+        self.path = os.path.join(self.directory, 'agent.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def start(self):
+        server = agent.AgentServer(self.path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_status(self):
+        self.start()
+        response = agent.request('status', path=self.path)
+        self.assertEqual(response['entries'], 0)
+        self.assertFalse(response['locked'])
+
+    def test_non_ascii_password(self):
+        password = u'p\u00e4ssw\u00f6rd'.encode('utf-8')
+        password_get = credentials.password_get
+        credentials.password_get = lambda env, parameter: password
+        self.addCleanup(setattr, credentials, 'password_get', password_get)
+        os.environ[agent.SOCKET_ENV] = self.path
+        self.addCleanup(os.environ.pop, agent.SOCKET_ENV)
+        self.start()
+        self.assertEqual(agent.password_get('dfw', 'OS_PASSWORD'), password)
+
+    def test_live_agent_is_kept(self):
+        self.start()
+        self.assertRaises(AttributeError, agent.AgentServer, self.path)
+        self.assertTrue(agent.request('status', path=self.path)['ok'])
+
+    def test_stale_socket_is_replaced(self):
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+        self.start()
+        self.assertTrue(agent.request('status', path=self.path)['ok'])
+
+    def test_other_files_are_kept(self):
+        with open(self.path, 'w') as other:
+            other.write('data')
+        self.assertRaises(AttributeError, agent.AgentServer, self.path)
+        self.assertTrue(os.path.isfile(self.path))
+
+    def test_writable_directory_is_refused(self):
+        os.chmod(self.directory, 0o777)
+        self.assertRaises(AttributeError, agent.AgentServer, self.path)
+
+    def test_shared_directory_must_be_private(self):
+        os.chmod(self.directory, 0o755)
+        self.assertRaises(AttributeError, agent.check_socket_dir,
+                          os.path.join(tempfile.gettempdir(),
+                                       os.path.basename(self.directory)))
+
+    @unittest.skipUnless(os.getuid() == 0, 'needs to be able to chown')
+    def test_directory_of_another_user_is_refused(self):
+        os.chown(self.directory, 12345, -1)
+        self.assertRaises(AttributeError, agent.AgentServer, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
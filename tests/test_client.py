@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+
+from multistack import client
+from multistack import config
+from multistack import timings
+
+
+class SettingsTest(unittest.TestCase):
+
+    def setUp(self):
+        # The settings don't need a loaded configuration
+        self.multiclient = client.MultiClient.__new__(client.MultiClient)
+
+    def test_setting_from_section(self):
+        value = self.multiclient.get_setting({'MULTISTACK_TIMEOUT': '2.5'},
+                                             None, 'MULTISTACK_TIMEOUT',
+                                             float)
+        self.assertEqual(value, 2.5)
+
+    def test_command_line_wins(self):
+        value = self.multiclient.get_setting({'MULTISTACK_RETRIES': '2'}, 5,
+                                             'MULTISTACK_RETRIES', int)
+        self.assertEqual(value, 5)
+
+    def test_bad_setting_is_reported(self):
+        with self.assertRaises(AttributeError) as caught:
+            self.multiclient.get_setting({'MULTISTACK_TIMEOUT': 'soon'},
+                                         None, 'MULTISTACK_TIMEOUT', float)
+        self.assertIn('\'soon\'', str(caught.exception))
+
+    def test_bad_parallel_is_reported(self):
+        class Args(object):
+            parallel = 'many'
+        self.multiclient._client_env = None
+        with self.assertRaises(AttributeError) as caught:
+            self.multiclient.get_parallel(Args())
+        self.assertIn('\'many\'', str(caught.exception))
+
+
+class FakeClient(client.MultiClient):
+    """
+    Builds stand-ins for python clients from a configuration in memory.
+    """
+
+    def __init__(self):
+        self.timings = timings.Timings()
+        self.client_config = config.CompiledConfig.compile_sections([
+            ('dfw', [('os_username', 'a'), ('multistack_tags', 'prod')]),
+            ('ord', [('os_username', 'b'), ('multistack_tags', 'prod')]),
+            ('lab', [('os_username', 'c')]),
+            ('us', [('multistack_group', 'dfw,ord'),
+                    ('multistack_timeout', '30'),
+                    ('multistack_retries', '2')]),
+        ])
+        self._client_env = None
+        self.run_config = []
+        self.credential_cache = {}
+        self.prefix_list = ['os_', 'multistack_']
+
+    def get_session(self, env):
+        return env
+
+    def make_client(self, session, creds):
+        return (session, creds['OS_USERNAME'])
+
+
+class GetClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.multiclient = FakeClient()
+
+    def test_single_environment(self):
+        self.assertEqual(self.multiclient.get_client('lab'), ('lab', 'c'))
+
+    def test_group(self):
+        self.assertEqual(self.multiclient.get_client('us'),
+                         {'dfw': ('dfw', 'a'), 'ord': ('ord', 'b')})
+
+    def test_pattern(self):
+        self.assertEqual(self.multiclient.get_client('l*'),
+                         {'lab': ('lab', 'c')})
+
+    def test_selection(self):
+        self.multiclient.select(tags='prod')
+        self.assertEqual(self.multiclient.get_client(),
+                         {'dfw': ('dfw', 'a'), 'ord': ('ord', 'b')})
+
+    def test_nothing_chosen(self):
+        self.assertRaises(AttributeError, self.multiclient.get_client)
+
+
+class RunLimitsTest(unittest.TestCase):
+
+    class Args(object):
+        timeout = retries = backoff = retry_on = cache_ttl = None
+
+    def setUp(self):
+        self.multiclient = FakeClient()
+
+    def test_group_settings_apply_to_members(self):
+        self.multiclient._client_env = 'us'
+        limits = self.multiclient.get_run_limits(
+            {'MULTISTACK_RETRIES': '1'}, self.Args())
+        self.assertEqual(limits['timeout'], 30)
+        # The member's own section wins
+        self.assertEqual(limits['retries'], 1)
+
+    def test_no_group(self):
+        limits = self.multiclient.get_run_limits({}, self.Args())
+        self.assertIsNone(limits['timeout'])
+        self.assertEqual(limits['retries'], 0)
+
+
+class WatchTest(unittest.TestCase):
+
+    def test_spans_dont_pile_up(self):
+        multiclient = FakeClient()
+        multiclient.timings.add('keyring', 'dfw', 0, 1)
+        runs = []
+
+        def run_jobs(jobs, multistack_args, mux, report=True):
+            runs.append(len(multiclient.timings.spans))
+            if len(runs) == 3:
+                raise KeyboardInterrupt()
+            multiclient.timings.add('wait', 'dfw', 1, 2)
+            multiclient.results = []
+            return 0
+
+        class Args(object):
+            watch = 0.001
+            dryrun = merge_json = output = timings = trace = None
+            parallel = 1
+        multiclient.run_jobs = run_jobs
+        multiclient.run_watch([('dfw', 'dfw', {}, ['list'])], Args())
+        self.assertEqual(runs, [1, 1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from multistack import config
+
+
+class ConfigCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.old_environ = dict(os.environ)
+        self.old_cwd = os.getcwd()
+        for name in ['HOME', 'XDG_CONFIG_HOME', 'XDG_CACHE_HOME', 'work']:
+            os.mkdir(os.path.join(self.directory, name))
+        os.environ['HOME'] = os.path.join(self.directory, 'HOME')
+        os.environ['XDG_CONFIG_HOME'] = os.path.join(self.directory,
+                                                     'XDG_CONFIG_HOME')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.directory,
+                                                    'XDG_CACHE_HOME')
+        with open(os.path.join(os.environ['HOME'], '.multistack'),
+                  'w') as config_file:
+            config_file.write('[dfw]\nOS_PASSWORD = secret\n')
+        self.cache_dir = os.path.join(os.environ['XDG_CACHE_HOME'],
+                                      'multistack')
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        os.environ.clear()
+        os.environ.update(self.old_environ)
+        shutil.rmtree(self.directory)
+
+    def test_working_directory_does_not_add_caches(self):
+        for name in ['HOME', 'work', 'XDG_CONFIG_HOME']:
+            os.chdir(os.path.join(self.directory, name))
+            self.assertEqual(config.load_multistack_config().sections(),
+                             ['dfw'])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_local_config_is_read(self):
+        work = os.path.join(self.directory, 'work')
+        with open(os.path.join(work, '.multistack'), 'w') as config_file:
+            config_file.write('[ord]\nOS_USERNAME = b\n')
+        os.chdir(work)
+        self.assertEqual(config.load_multistack_config().sections(),
+                         ['dfw', 'ord'])
+
+    def test_cache_is_private(self):
+        config.load_multistack_config()
+        for name in os.listdir(self.cache_dir):
+            mode = os.stat(os.path.join(self.cache_dir, name)).st_mode
+            self.assertEqual(stat.S_IMODE(mode), 0o600)
+
+    def test_broken_sections_cache(self):
+        fragments = os.path.join(os.environ['HOME'], '.multistack.d')
+        os.mkdir(fragments)
+        with open(os.path.join(fragments, 'ord.conf'), 'w') as fragment:
+            fragment.write('[ord]\nOS_USERNAME = b\n')
+        config.load_multistack_config()
+        # Only the main file changes, so the fragment comes from the cache
+        with open(os.path.join(os.environ['HOME'], '.multistack'),
+                  'a') as config_file:
+            config_file.write('OS_USERNAME = a\n')
+        # A sections cache that can't be read, in a cache directory nothing
+        # can be removed from
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('-sections.json'):
+                path = os.path.join(self.cache_dir, name)
+                os.unlink(path)
+                os.mkdir(path)
+
+        def unlink(path):
+            raise OSError('Read-only file system')
+        real_unlink = os.unlink
+        os.unlink = unlink
+        try:
+            sections = config.load_multistack_config().sections()
+        finally:
+            os.unlink = real_unlink
+        self.assertEqual(sections, ['dfw', 'ord'])
+
+
+if __name__ == '__main__':
+    unittest.main()
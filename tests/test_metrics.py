@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import unittest
+
+from multistack import metrics
+from multistack import results
+
+
+def make_result(env, returncode, duration, label=None):
+    result = results.EnvResult(env, '/usr/bin/nova', label)
+    result.returncode = returncode
+    result.duration = duration
+    result.attempts = 1
+    return result
+
+
+class PrometheusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'multistack.prom')
+        self.results = [make_result('dfw', 0, 1.5),
+                        make_result('ord', 2, 0.25)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_textfile(self):
+        lines = metrics.prometheus_lines(self.results, {'dfw': 0.125},
+                                         'nova', now=1000)
+        metrics.write_textfile(self.path, lines)
+        with open(self.path) as metrics_file:
+            written = metrics_file.read().splitlines()
+        self.assertIn('multistack_run_duration_seconds{env="dfw",'
+                      'executable="nova"} 1.5', written)
+        self.assertIn('multistack_run_success{env="ord",executable="nova"} 0',
+                      written)
+        self.assertIn('multistack_run_exit_code{env="ord",'
+                      'executable="nova"} 2', written)
+        self.assertIn('multistack_keyring_lookup_seconds{env="dfw",'
+                      'executable="nova"} 0.125', written)
+        self.assertIn('multistack_last_run_timestamp_seconds{'
+                      'executable="nova"} 1000', written)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o644)
+        # No temporary files are left behind
+        self.assertEqual(os.listdir(self.directory), ['multistack.prom'])
+
+    def test_textfile_is_replaced(self):
+        metrics.write_textfile(self.path, ['old 1'])
+        metrics.write_textfile(self.path, ['new 1'])
+        with open(self.path) as metrics_file:
+            self.assertEqual(metrics_file.read(), 'new 1\n')
+
+    def test_labels_are_escaped(self):
+        result = make_result('dfw', 0, 1, label='dfw: "list"')
+        lines = metrics.prometheus_lines([result], {}, 'nova', now=1)
+        self.assertIn('multistack_run_attempts{env="dfw",executable="nova",'
+                      'run="dfw: \\"list\\""} 1', lines)
+
+
+class StatsdTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(5)
+        self.address = '127.0.0.1:%d' % self.sock.getsockname()[1]
+
+    def tearDown(self):
+        self.sock.close()
+
+    def receive(self):
+        return self.sock.recv(65536).decode('utf-8').split('\n')
+
+    def test_datagrams(self):
+        result = make_result('dfw.prod', 1, 0.5)
+        lines = metrics.statsd_lines([result], {'dfw.prod': 0.25}, 'nova')
+        metrics.send_statsd(self.address, lines)
+        self.assertEqual(self.receive(), [
+            'multistack.nova.dfw_prod.duration:500|ms',
+            'multistack.nova.dfw_prod.runs:1|c',
+            'multistack.nova.dfw_prod.failures:1|c',
+            'multistack.nova.dfw_prod.exit_code:1|g',
+            'multistack.nova.dfw_prod.keyring:250|ms'])
+
+    def test_packets_are_split(self):
+        lines = ['multistack.nova.env%03d.runs:1|c' % number
+                 for number in range(200)]
+        metrics.send_statsd(self.address, lines)
+        received = []
+        while len(received) < len(lines):
+            packet = self.sock.recv(65536)
+            self.assertLessEqual(len(packet), metrics.STATSD_PACKET_SIZE)
+            received += packet.decode('utf-8').split('\n')
+        self.assertEqual(received, lines)
+
+    def test_address(self):
+        self.assertEqual(metrics.parse_address('stats'), ('stats', 8125))
+        self.assertEqual(metrics.parse_address('stats:9125'),
+                         ('stats', 9125))
+        self.assertRaises(AttributeError, metrics.parse_address, 'stats:x')
+
+
+if __name__ == '__main__':
+    unittest.main()
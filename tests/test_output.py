@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import io
+import json
+import unittest
+
+from multistack import output
+from multistack import results
+
+
+class JsonMultiplexerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+        self.stderr = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+        self.mux = output.JsonMultiplexer(['a', 'b'], 'array', self.stdout,
+                                          self.stderr)
+
+    def written(self, stream):
+        stream.flush()
+        return stream.buffer.getvalue().decode('utf-8')
+
+    def test_nothing_written_before_records(self):
+        self.assertEqual(self.written(self.stdout), '')
+        self.mux.close()
+        self.assertEqual(json.loads(self.written(self.stdout)), [])
+
+    def test_records_are_merged(self):
+        self.mux.feed('a', b'[{"ID": 1}, {"ID": 2}]\n', b'')
+        self.mux.feed('b', b'{"ID": 3}\n', b'')
+        self.mux.close()
+        records = json.loads(self.written(self.stdout))
+        self.assertEqual([(r['Environment'], r['ID']) for r in records],
+                         [('a', 1), ('a', 2), ('b', 3)])
+        self.assertFalse(self.mux.invalid)
+
+    def test_invalid_output_goes_to_stderr(self):
+        self.mux.feed('a', b'ID  Name\n1   x\n', b'')
+        self.mux.close()
+        self.assertEqual(self.mux.invalid, set(['a']))
+        self.assertEqual(self.written(self.stderr),
+                         '[a] ID  Name\n[a] 1   x\n')
+        self.assertEqual(json.loads(self.written(self.stdout)), [])
+
+    def test_next_attempt_can_succeed(self):
+        self.mux.feed('a', b'oops\n', b'')
+        self.mux.feed('a', b'[]\n', b'')
+        self.assertFalse(self.mux.invalid)
+
+
+class EnvResultTest(unittest.TestCase):
+
+    def test_invalid_output_fails(self):
+        result = results.EnvResult('a')
+        result.returncode = 0
+        result.invalid_output = True
+        self.assertTrue(result.failed)
+        self.assertEqual(result.status, 'invalid json')
+        self.assertEqual(results.exit_status([result]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
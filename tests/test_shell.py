@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+
+from multistack import shell
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.default_executable = 'nova'
+        self.prefix_list = ['os_', 'multistack_']
+
+
+class ParseArgsTest(unittest.TestCase):
+
+    def parse(self, args, selecting=True):
+        multishell = shell.MultiShell(FakeClient)
+        multishell.build_parser(selecting=selecting)
+        return multishell.parse_args(args)
+
+    def test_options_after_env_go_to_client(self):
+        args, client_args = self.parse(['-x', 'fakecli', 'c', 'list',
+                                        '--tags', 'tier:prod'])
+        self.assertEqual(args.env, 'c')
+        self.assertEqual(args.executable, 'fakecli')
+        self.assertIsNone(args.tags)
+        self.assertEqual(client_args, ['list', '--tags', 'tier:prod'])
+
+    def test_client_options_named_like_wrapper_options(self):
+        args, client_args = self.parse(['a', 'stack-create', '--timeout',
+                                        '60', '-e', 'env.yaml', 'x'])
+        self.assertIsNone(args.timeout)
+        self.assertEqual(args.exit_policy, 'any')
+        self.assertEqual(client_args, ['stack-create', '--timeout', '60',
+                                       '-e', 'env.yaml', 'x'])
+
+    def test_abbreviations_are_not_taken(self):
+        args, client_args = self.parse(['c', 'image', 'list', '--tag', 'foo'])
+        self.assertIsNone(args.tags)
+        self.assertEqual(client_args, ['image', 'list', '--tag', 'foo'])
+
+    def test_selection_gives_first_word_back_to_client(self):
+        args, client_args = self.parse(['--tags', 'region:us', 'list',
+                                        '--tags', 'web'])
+        self.assertEqual(args.tags, 'region:us')
+        self.assertIsNone(args.env)
+        self.assertEqual(client_args, ['list', '--tags', 'web'])
+
+    def test_list_after_env_goes_to_client(self):
+        args, client_args = self.parse(['ord', 'list', '-l'])
+        self.assertFalse(args.listenvs)
+        self.assertEqual(client_args, ['list', '-l'])
+        args, client_args = self.parse(['-l'])
+        self.assertTrue(args.listenvs)
+
+    def test_without_selection(self):
+        args, client_args = self.parse(['--timeout', '5', 'list', '--timeout',
+                                        '6'], selecting=False)
+        self.assertEqual(args.timeout, 5)
+        self.assertEqual(client_args, ['list', '--timeout', '6'])
+
+
+if __name__ == '__main__':
+    unittest.main()
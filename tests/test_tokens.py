@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from multistack import tokens
+from multistack.clients import nova
+from multistack.clients import swift
+
+CATALOG = [
+    {'type': 'object-store', 'endpoints': [
+        {'interface': 'public', 'region_id': 'north',
+         'url': 'http://swift.north/v1/AUTH_p'},
+        {'interface': 'public', 'region_id': 'south',
+         'url': 'http://swift.south/v1/AUTH_p'},
+        {'interface': 'internal', 'region_id': 'south',
+         'url': 'http://swift.internal/v1/AUTH_p'}]},
+]
+
+
+class StubKeystone(BaseHTTPRequestHandler):
+    """
+    Answers v3 password authentication with a fixed token and catalog, and
+    keeps the bodies it was sent.
+    """
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length'))
+        self.server.requests.append(json.loads(
+            self.rfile.read(length).decode('utf-8')))
+        body = json.dumps({'token': {'expires_at': self.server.expires,
+                                     'catalog': CATALOG}}).encode('utf-8')
+        self.send_response(201)
+        self.send_header('X-Subject-Token', 'stub-token')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TokensTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubKeystone)
+        self.server.requests = []
+        self.server.expires = '2099-01-01T00:00:00Z'
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.cache_home = tempfile.mkdtemp()
+        self.old_cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = self.cache_home
+        self.env_config = {
+            'OS_AUTH_URL': 'http://127.0.0.1:%d/v3' % self.server.server_port,
+            'OS_USERNAME': 'user',
+            'OS_PASSWORD': 'secret',
+            'OS_PROJECT_NAME': 'project',
+            'OS_USER_DOMAIN_ID': 'udom',
+            'OS_PROJECT_DOMAIN_ID': 'pdom',
+            'OS_REGION_NAME': 'south',
+        }
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_home)
+        if self.old_cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.old_cache_home
+
+    def test_domain_ids_are_sent(self):
+        tokens.get_token(self.env_config)
+        auth = self.server.requests[0]['auth']
+        self.assertEqual(auth['identity']['password']['user']['domain'],
+                         {'id': 'udom'})
+        self.assertEqual(auth['scope']['project']['domain'], {'id': 'pdom'})
+
+    def test_domain_names_default(self):
+        del self.env_config['OS_USER_DOMAIN_ID']
+        self.env_config['OS_PROJECT_DOMAIN_NAME'] = 'Other'
+        del self.env_config['OS_PROJECT_DOMAIN_ID']
+        url, body = tokens.auth_request(self.env_config)
+        self.assertEqual(body['auth']['identity']['password']['user'][
+            'domain'], {'name': 'Default'})
+        self.assertEqual(body['auth']['scope']['project']['domain'],
+                         {'name': 'Other'})
+
+    def test_token_is_cached(self):
+        first = tokens.get_token(self.env_config)
+        second = tokens.get_token(self.env_config)
+        self.assertEqual(first, second)
+        self.assertEqual(first[0], 'stub-token')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_expiry_offsets(self):
+        expected = tokens.parse_expiry('2030-01-01T00:00:00Z')
+        for expires in ['2030-01-01T00:00:00.000000Z',
+                        '2030-01-01T02:00:00+02:00',
+                        '2029-12-31T19:30:00.5-04:30']:
+            self.assertEqual(tokens.parse_expiry(expires), expected)
+
+    def test_bad_expiry_is_a_token_error(self):
+        for expires in [None, 'tomorrow']:
+            self.server.expires = expires
+            self.assertRaises(tokens.TokenError, tokens.get_token,
+                              self.env_config)
+
+    def test_endpoint_for_region_and_interface(self):
+        token, catalog = tokens.get_token(self.env_config)
+        self.assertEqual(tokens.endpoint_url(self.env_config, catalog,
+                                             ['object-store']),
+                         'http://swift.south/v1/AUTH_p')
+        self.env_config['OS_INTERFACE'] = 'internal'
+        self.assertEqual(tokens.endpoint_url(self.env_config, catalog,
+                                             ['object-store']),
+                         'http://swift.internal/v1/AUTH_p')
+        self.assertIsNone(tokens.endpoint_url(self.env_config, catalog,
+                                              ['compute']))
+
+    def test_client_is_given_its_endpoint(self):
+        multiswift = swift.MultiSwift.__new__(swift.MultiSwift)
+        multiswift.service_types = ['object-store']
+        multiswift.token_variables = ('OS_AUTH_TOKEN', 'OS_STORAGE_URL')
+        token_config = multiswift.get_token_config(self.env_config)
+        self.assertNotIn('OS_PASSWORD', token_config)
+        self.assertEqual(token_config['OS_AUTH_TOKEN'], 'stub-token')
+        self.assertEqual(token_config['OS_STORAGE_URL'],
+                         'http://swift.south/v1/AUTH_p')
+
+    def test_client_without_endpoint_variables(self):
+        multinova = nova.MultiNova.__new__(nova.MultiNova)
+        multinova.service_types = []
+        multinova.token_variables = None
+        token_config = multinova.get_token_config(self.env_config)
+        self.assertEqual(token_config['OS_AUTH_TYPE'], 'token')
+        self.assertEqual(token_config['OS_TOKEN'], 'stub-token')
+        self.assertNotIn('OS_URL', token_config)
+
+
+if __name__ == '__main__':
+    unittest.main()
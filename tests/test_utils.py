@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+#
+# Copyright 2014 M. David Bennett
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+
+from multistack import utils
+
+
+class SecretTest(unittest.TestCase):
+
+    def test_secrets(self):
+        for param in ['OS_PASSWORD', 'os_token', 'OS_AUTH_TOKEN',
+                      'OS_SERVICE_TOKEN', 'RAX_API_KEY', 'NOVA_APIKEY',
+                      'OS_APPLICATION_CREDENTIAL_SECRET']:
+            self.assertTrue(utils.is_secret(param), param)
+
+    def test_settings(self):
+        for param in ['MULTISTACK_TOKEN_CACHE', 'OS_USERNAME', 'OS_KEY',
+                      'OS_AUTH_URL', 'OS_CERT']:
+            self.assertFalse(utils.is_secret(param), param)
+
+
+if __name__ == '__main__':
+    unittest.main()